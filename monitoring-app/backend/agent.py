@@ -0,0 +1,89 @@
+"""Lightweight agent pushing this host's metrics to a central backend.
+
+Usage::
+
+    AGENT_TOKEN=... python agent.py --server ws://monitor.example:8000
+
+Samples are collected every ``--interval`` seconds and sent in batches every
+``--flush`` seconds over one persistent websocket to ``/ws/ingest``. While
+the server is unreachable up to ``--buffer`` samples are kept and sent after
+reconnecting; older ones are dropped.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+from collections import deque
+
+import websockets
+from dotenv import load_dotenv
+
+from collector import Collector
+from frames import pack
+from history import FIELDS, flatten
+
+AGENT_INTERVAL = 10.0
+AGENT_FLUSH = 30.0
+AGENT_BUFFER = 8640  # one day at the default interval
+MAX_BACKOFF = 60.0
+
+
+async def run(server: str, token: str, host: str, interval: float, flush: float, buffer: int) -> None:
+    collector = Collector(interval, top_n=0)
+    collector.start()
+    updates = collector.watch(asyncio.get_running_loop())
+    pending: deque = deque(maxlen=buffer)
+
+    async def gather():
+        while True:
+            snapshot = await updates.get()
+            pending.append([snapshot.ts] + flatten(snapshot.metrics))
+
+    gatherer = asyncio.create_task(gather())
+    url = server.rstrip("/") + "/ws/ingest"
+    backoff = 1.0
+    try:
+        while True:
+            try:
+                async with websockets.connect(url, additional_headers={"Authorization": f"Bearer {token}"}) as ws:
+                    await ws.send(pack({"type": "hello", "host": host, "fields": list(FIELDS)}))
+                    backoff = 1.0
+                    while True:
+                        if pending:
+                            batch = list(pending)
+                            pending.clear()
+                            try:
+                                await ws.send(pack({"type": "samples", "samples": batch}))
+                            except websockets.WebSocketException:
+                                # put the batch back ahead of newer samples; the oldest go first if full
+                                newer = list(pending)
+                                pending.clear()
+                                pending.extend(batch + newer)
+                                raise
+                        await asyncio.sleep(flush)
+            except (OSError, websockets.WebSocketException):
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+    finally:
+        gatherer.cancel()
+        collector.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", required=True, help="Central backend, e.g. ws://monitor:8000")
+    parser.add_argument("--host", default=socket.gethostname(), help="Name this host reports as")
+    parser.add_argument("--interval", type=float, default=AGENT_INTERVAL, help="Seconds between samples")
+    parser.add_argument("--flush", type=float, default=AGENT_FLUSH, help="Seconds between batches")
+    parser.add_argument("--buffer", type=int, default=AGENT_BUFFER, help="Samples kept while disconnected")
+    args = parser.parse_args()
+    load_dotenv()
+    token = os.getenv("AGENT_TOKEN")
+    if not token:
+        parser.error("AGENT_TOKEN must be set")
+    asyncio.run(run(args.server, token, args.host, args.interval, args.flush, args.buffer))
+
+
+if __name__ == "__main__":
+    main()
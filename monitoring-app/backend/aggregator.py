@@ -0,0 +1,119 @@
+"""Per-host series and fleet rollups for samples pushed by agents."""
+
+import math
+import time
+from typing import Dict, List, Optional, Sequence
+
+from history import FIELDS, MetricHistory
+
+# coarser than the local history: ~270 KiB per host
+AGENT_RESOLUTIONS = ((10.0, 360), (60.0, 360), (3600.0, 168))
+FLEET_INTERVAL = 10.0
+MAX_HOSTS = 1000
+# hosts silent for longer are left out of fleet rollups
+HOST_STALE = 60.0
+# samples stamped further ahead than this are dropped (broken agent clock)
+MAX_CLOCK_SKEW = 300.0
+FLEET_AGGREGATES = ("mean", "max")
+
+
+class HostSeries:
+    """History and latest values of one agent's host."""
+
+    __slots__ = ("name", "history", "last_seen", "latest_ts", "latest", "columns", "width")
+
+    def __init__(self, name: str, fields: Sequence[str], resolutions):
+        self.name = name
+        self.history = MetricHistory(fields=fields, resolutions=resolutions)
+        self.last_seen = 0.0
+        self.latest_ts = 0.0
+        self.latest: List[float] = [math.nan] * len(fields)
+        self.columns: List[Optional[int]] = []
+        # values per row in the agent's own field order
+        self.width = 0
+
+
+class Fleet:
+    """All hosts reporting to this instance.
+
+    Each host gets its own fixed-size rings; at most ``max_hosts`` are
+    tracked. Every ``FLEET_INTERVAL`` :meth:`rollup` folds the across-host
+    mean and max of every field into a fleet history.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str] = FIELDS,
+        resolutions=AGENT_RESOLUTIONS,
+        max_hosts: int = MAX_HOSTS,
+    ):
+        self.fields = tuple(fields)
+        self.resolutions = resolutions
+        self.max_hosts = max_hosts
+        self.hosts: Dict[str, HostSeries] = {}
+        self.history = MetricHistory(
+            fields=[f"{name}.{agg}" for name in self.fields for agg in FLEET_AGGREGATES]
+        )
+        self.stats = {"samples": 0, "rejected": 0}
+
+    def register(self, name: str, fields: Sequence[str]) -> HostSeries:
+        """The series for ``name``, mapping the agent's field order onto ours."""
+        series = self.hosts.get(name)
+        if series is None:
+            if len(self.hosts) >= self.max_hosts:
+                raise ValueError("too many hosts")
+            series = self.hosts[name] = HostSeries(name, self.fields, self.resolutions)
+        position = {field: i for i, field in enumerate(fields)}
+        series.columns = [position.get(field) for field in self.fields]
+        series.width = len(fields)
+        series.last_seen = time.time()
+        return series
+
+    def ingest(self, series: HostSeries, samples: Sequence[Sequence[float]]) -> None:
+        """Fold in rows of ``[ts, value, ...]`` in the agent's field order."""
+        now = time.time()
+        columns = series.columns
+        for row in samples:
+            ts = row[0]
+            if not math.isfinite(ts) or ts > now + MAX_CLOCK_SKEW or len(row) < series.width + 1:
+                self.stats["rejected"] += 1
+                continue
+            values = [_number(row[1 + i]) if i is not None else math.nan for i in columns]
+            series.history.add_values(ts, values)
+            if ts >= series.latest_ts:
+                series.latest_ts = ts
+                series.latest = values
+            self.stats["samples"] += 1
+        series.last_seen = now
+
+    def rollup(self, now: Optional[float] = None) -> int:
+        """Add one fleet sample from the fresh hosts; return how many were included."""
+        now = time.time() if now is None else now
+        fresh = [s.latest for s in self.hosts.values() if now - s.last_seen <= HOST_STALE]
+        if not fresh:
+            return 0
+        values = []
+        for i in range(len(self.fields)):
+            column = [row[i] for row in fresh if row[i] == row[i]]
+            values.append(sum(column) / len(column) if column else math.nan)
+            values.append(max(column) if column else math.nan)
+        self.history.add_values(now, values)
+        return len(fresh)
+
+    def summary(self) -> List[Dict]:
+        now = time.time()
+        return [
+            {
+                "host": s.name,
+                "last_seen": s.last_seen,
+                "stale": now - s.last_seen > HOST_STALE,
+                "latest": {
+                    name: (None if value != value else value) for name, value in zip(self.fields, s.latest)
+                },
+            }
+            for s in sorted(self.hosts.values(), key=lambda s: s.name)
+        ]
+
+
+def _number(value) -> float:
+    return float(value) if value is not None else math.nan
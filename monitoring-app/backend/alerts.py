@@ -0,0 +1,153 @@
+"""Rule-based and statistical alerts evaluated on every sample.
+
+Rules are cheap per-sample checks on one history field:
+
+- ``threshold`` – the value is at or above ``limit`` (below with ``below``);
+- ``rate`` – the value changes faster than ``limit`` per second;
+- ``zscore`` – the value is more than ``limit`` standard deviations from
+  its exponentially weighted moving average (after ``warmup`` samples, and
+  at least ``min_delta`` away from it).
+
+A rule fires once its condition has held for ``for_samples`` consecutive
+samples and resolves once it has been clear for as many.
+"""
+
+import json
+import math
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence
+
+from history import FIELDS
+
+RULE_KINDS = ("threshold", "rate", "zscore")
+
+
+@dataclass
+class Rule:
+    name: str
+    field: str
+    kind: str
+    limit: float
+    for_samples: int = 1
+    below: bool = False
+    alpha: float = 0.02
+    warmup: int = 30
+    min_delta: float = 0.0
+
+
+DEFAULT_RULES = (
+    Rule("cpu_high", "cpu", "threshold", 90, for_samples=3),
+    Rule("memory_high", "memory.percent", "threshold", 90, for_samples=3),
+    Rule("swap_high", "swap.percent", "threshold", 50, for_samples=3),
+    Rule("disk_full", "disk.percent", "threshold", 95),
+    Rule("process_spike", "processes", "rate", 20),
+    Rule("cpu_anomaly", "cpu", "zscore", 4, for_samples=2, min_delta=20),
+    Rule("net_out_anomaly", "net_rate.bytes_sent", "zscore", 6, for_samples=2, min_delta=1_000_000),
+    Rule("net_in_anomaly", "net_rate.bytes_recv", "zscore", 6, for_samples=2, min_delta=1_000_000),
+    Rule("disk_write_anomaly", "disk_io.write_bytes", "zscore", 6, for_samples=2, min_delta=10_000_000),
+)
+
+
+def load_rules(path: Optional[str]) -> List[Rule]:
+    """Rules from a JSON list of :class:`Rule` fields, or the defaults."""
+    if not path:
+        return list(DEFAULT_RULES)
+    with open(path, encoding="utf-8") as fh:
+        rules = [Rule(**item) for item in json.load(fh)]
+    for rule in rules:
+        if rule.kind not in RULE_KINDS:
+            raise ValueError(f"{rule.name}: unknown rule kind {rule.kind}")
+    return rules
+
+
+class _State:
+    __slots__ = ("column", "streak", "clear", "alert", "mean", "var", "seen", "prev", "prev_ts")
+
+    def __init__(self, column: int):
+        self.column = column
+        self.streak = 0
+        self.clear = 0
+        self.alert: Optional[Dict] = None
+        self.mean = 0.0
+        self.var = 0.0
+        self.seen = 0
+        self.prev = math.nan
+        self.prev_ts = 0.0
+
+
+class AlertEngine:
+    """Evaluates every rule against each sample and reports state changes."""
+
+    def __init__(self, rules: Sequence[Rule], fields: Sequence[str] = FIELDS):
+        columns = {field: i for i, field in enumerate(fields)}
+        for rule in rules:
+            if rule.field not in columns:
+                raise ValueError(f"{rule.name}: unknown field {rule.field}")
+        self.rules = list(rules)
+        self._states = [_State(columns[rule.field]) for rule in self.rules]
+        self._next_id = 1
+
+    def active(self) -> List[Dict]:
+        return [state.alert for state in self._states if state.alert is not None]
+
+    def evaluate(self, ts: float, values: Sequence[float]) -> List[Dict]:
+        """Feed one sample; return ``firing``/``resolved`` events."""
+        events = []
+        for rule, state in zip(self.rules, self._states):
+            value = values[state.column]
+            if value != value:
+                continue
+            hit = self._check(rule, state, ts, value)
+            if hit:
+                state.streak += 1
+                state.clear = 0
+                if state.alert is None and state.streak >= rule.for_samples:
+                    state.alert = {
+                        "id": self._next_id,
+                        "rule": rule.name,
+                        "field": rule.field,
+                        "kind": rule.kind,
+                        "limit": rule.limit,
+                        "value": value,
+                        "since": ts,
+                    }
+                    self._next_id += 1
+                    events.append(dict(state.alert, state="firing", ts=ts))
+                elif state.alert is not None:
+                    state.alert["value"] = value
+            else:
+                state.streak = 0
+                state.clear += 1
+                if state.alert is not None and state.clear >= rule.for_samples:
+                    events.append(dict(state.alert, state="resolved", value=value, ts=ts))
+                    state.alert = None
+        return events
+
+    @staticmethod
+    def _check(rule: Rule, state: _State, ts: float, value: float) -> bool:
+        if rule.kind == "threshold":
+            return value <= rule.limit if rule.below else value >= rule.limit
+        if rule.kind == "rate":
+            prev, prev_ts = state.prev, state.prev_ts
+            state.prev, state.prev_ts = value, ts
+            if prev != prev or ts <= prev_ts:
+                return False
+            return abs(value - prev) / (ts - prev_ts) >= rule.limit
+        # zscore against the EWMA before folding the value in
+        delta = value - state.mean
+        hit = (
+            state.seen >= rule.warmup
+            and abs(delta) >= rule.min_delta
+            and abs(delta) > rule.limit * math.sqrt(state.var)
+        )
+        if state.seen == 0:
+            state.mean = value
+        else:
+            state.mean += rule.alpha * delta
+            state.var = (1 - rule.alpha) * (state.var + rule.alpha * delta * delta)
+        state.seen += 1
+        return hit
+
+
+def describe(rules: Sequence[Rule]) -> List[Dict]:
+    return [asdict(rule) for rule in rules]
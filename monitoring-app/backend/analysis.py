@@ -0,0 +1,91 @@
+"""Cached, coalesced model analysis of the current metrics."""
+
+import asyncio
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from history import flatten
+
+ANALYSIS_TTL = 300.0
+ANALYSIS_MIN_INTERVAL = 10.0
+# change in a field that makes the cached analysis stale
+ANALYSIS_THRESHOLDS = "cpu=15,memory.percent=5,swap.percent=5,disk.percent=2,processes=25"
+
+
+def parse_thresholds(spec: str) -> Dict[str, float]:
+    """``"cpu=15,memory.percent=5"`` -> ``{"cpu": 15.0, "memory.percent": 5.0}``."""
+    thresholds = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            thresholds[name.strip()] = float(value)
+    return thresholds
+
+
+class CachedAnalysis:
+    """Reuses the last analysis until the metrics change or it expires.
+
+    A new analysis is requested when any field moved by at least its
+    threshold since the cached one, or after ``ttl`` seconds, but never more
+    often than every ``min_interval`` seconds. Concurrent callers share the
+    one request in flight.
+    """
+
+    def __init__(
+        self,
+        analyze: Callable[[Dict], Awaitable[Dict]],
+        ttl: float = ANALYSIS_TTL,
+        min_interval: float = ANALYSIS_MIN_INTERVAL,
+        thresholds: Optional[Dict[str, float]] = None,
+    ):
+        self._analyze = analyze
+        self.ttl = ttl
+        self.min_interval = min_interval
+        if thresholds is None:
+            thresholds = parse_thresholds(ANALYSIS_THRESHOLDS)
+        self.fields = tuple(thresholds)
+        self.limits = tuple(thresholds.values())
+        self.stats = {"requests": 0, "cached": 0, "coalesced": 0}
+        self._result: Optional[Dict] = None
+        self._basis: List[float] = []
+        self._analyzed_at = -math.inf
+        self._last: Optional[Dict] = None
+        self._requested_at = -math.inf
+        self._inflight: Optional[asyncio.Future] = None
+
+    def _fresh(self, values: List[float], now: float) -> bool:
+        if self._result is None or now - self._analyzed_at >= self.ttl:
+            return False
+        # NaN differences compare false, so missing fields never invalidate
+        return not any(abs(v - b) >= limit for v, b, limit in zip(values, self._basis, self.limits))
+
+    async def analyze(self, metrics: Dict) -> Dict:
+        values = flatten(metrics, self.fields)
+        now = time.monotonic()
+        if self._fresh(values, now):
+            self.stats["cached"] += 1
+            return self._result
+        if self._inflight is not None:
+            self.stats["coalesced"] += 1
+        elif self._last is not None and now - self._requested_at < self.min_interval:
+            # rate limited: the latest good analysis, else the latest error
+            self.stats["cached"] += 1
+            return self._result if self._result is not None else self._last
+        else:
+            self._inflight = asyncio.ensure_future(self._request(metrics, values))
+        return await asyncio.shield(self._inflight)
+
+    async def _request(self, metrics: Dict, values: List[float]) -> Dict:
+        self.stats["requests"] += 1
+        self._requested_at = time.monotonic()
+        try:
+            result = await self._analyze(metrics)
+        finally:
+            self._inflight = None
+        self._last = result
+        if "error" not in result:
+            self._result = result
+            self._basis = values
+            self._analyzed_at = time.monotonic()
+        return result
@@ -0,0 +1,60 @@
+"""JWT verification with a small cache of already validated tokens."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import jwt
+
+TOKEN_CACHE = 1024
+
+
+class TokenCache:
+    """Decoded payloads of tokens that passed ``jwt.decode``, least recently used first.
+
+    A token is only served from the cache until its ``exp``; after that it is
+    decoded again, so expiry is enforced exactly as without the cache. The
+    key is the whole token string, signature included, so a cached entry can
+    only ever match the exact token that was verified. REST dependencies run
+    in the threadpool and websockets on the event loop, so the LRU is locked.
+    """
+
+    def __init__(self, secret: str, algorithm: str, max_entries: int = TOKEN_CACHE):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def verify(self, token: str) -> Dict:
+        """The token's payload; raises ``jwt.PyJWTError`` when it is invalid or expired."""
+        payload = self._get(token)
+        if payload is not None:
+            return payload
+        payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        # tokens without an expiry are still verified, just never cached
+        if self.max_entries > 0 and isinstance(payload.get("exp"), (int, float)):
+            self._put(token, payload)
+        return payload
+
+    def _get(self, token: str) -> Optional[Dict]:
+        with self._lock:
+            payload = self._entries.get(token)
+            if payload is not None and payload["exp"] <= time.time():
+                self._entries.pop(token, None)
+                payload = None
+            if payload is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(token)
+            self.stats["hits"] += 1
+            return payload
+
+    def _put(self, token: str, payload: Dict) -> None:
+        with self._lock:
+            self._entries[token] = payload
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
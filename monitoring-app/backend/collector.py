@@ -0,0 +1,136 @@
+"""psutil sampling on a worker thread, published as immutable snapshots."""
+
+import asyncio
+import heapq
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import psutil
+
+TOP_N = 5
+NET_FIELDS = ("bytes_sent", "bytes_recv", "packets_sent", "packets_recv")
+DISK_FIELDS = ("read_bytes", "write_bytes", "read_count", "write_count")
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """One sample; ``metrics`` is built fresh each time and never modified."""
+
+    ts: float
+    metrics: Dict
+
+
+def _rates(now, before, fields, elapsed: float) -> Optional[Dict[str, float]]:
+    if now is None or before is None or elapsed <= 0:
+        return None
+    return {name: max(0.0, (getattr(now, name) - getattr(before, name)) / elapsed) for name in fields}
+
+
+class Collector(threading.Thread):
+    """Samples the host every ``interval`` seconds off the event loop.
+
+    Counters are turned into per-second rates from the previous sample, and
+    ``psutil.Process`` handles are kept between samples so per-process CPU
+    is measured over the interval without re-reading every process from
+    scratch. ``latest`` always points at the newest snapshot.
+    """
+
+    def __init__(self, interval: float, top_n: int = TOP_N):
+        super().__init__(name="metrics-collector", daemon=True)
+        self.interval = interval
+        self.top_n = top_n
+        self.latest: Optional[Snapshot] = None
+        self._procs: Dict[int, psutil.Process] = {}
+        self._net = None
+        self._disk = None
+        self._at = 0.0
+        self._watchers: List = []
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+
+    def run(self) -> None:
+        psutil.cpu_percent(interval=None, percpu=True)
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                snapshot = self.collect()
+            except Exception:
+                # keep sampling; a transient psutil failure should not end the thread
+                snapshot = None
+            if snapshot is not None:
+                self.latest = snapshot
+                self._ready.set()
+                for loop, queue in list(self._watchers):
+                    loop.call_soon_threadsafe(_offer, queue, snapshot)
+            self._stop.wait(max(0.0, started + self.interval - time.monotonic()))
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        self._ready.wait(timeout)
+        return self.latest
+
+    def watch(self, loop: asyncio.AbstractEventLoop) -> asyncio.Queue:
+        """Queue on ``loop`` that receives every new snapshot; only the newest is kept."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._watchers.append((loop, queue))
+        return queue
+
+    def collect(self) -> Snapshot:
+        now = time.monotonic()
+        elapsed = now - self._at if self._at else 0.0
+        net = psutil.net_io_counters()
+        disk = psutil.disk_io_counters()
+        per_core = psutil.cpu_percent(interval=None, percpu=True)
+        metrics = {
+            "cpu": round(sum(per_core) / len(per_core), 1) if per_core else 0.0,
+            "cpu_per_core": per_core,
+            "memory": psutil.virtual_memory()._asdict(),
+            "swap": psutil.swap_memory()._asdict(),
+            "disk": psutil.disk_usage("/")._asdict(),
+            "net": net._asdict(),
+            "net_rate": _rates(net, self._net, NET_FIELDS, elapsed),
+            "disk_io": _rates(disk, self._disk, DISK_FIELDS, elapsed),
+        }
+        metrics.update(self._processes())
+        self._net, self._disk, self._at = net, disk, now
+        return Snapshot(time.time(), metrics)
+
+    def _processes(self) -> Dict:
+        pids = psutil.pids()
+        if not self.top_n:
+            return {"processes": len(pids)}
+        alive = set(pids)
+        for pid in [pid for pid in self._procs if pid not in alive]:
+            del self._procs[pid]
+        rows = []
+        for pid in pids:
+            proc = self._procs.get(pid)
+            try:
+                if proc is None:
+                    proc = self._procs[pid] = psutil.Process(pid)
+                with proc.oneshot():
+                    rows.append({
+                        "pid": pid,
+                        "name": proc.name(),
+                        "cpu": proc.cpu_percent(interval=None),
+                        "rss": proc.memory_info().rss,
+                    })
+            except psutil.NoSuchProcess:
+                self._procs.pop(pid, None)
+            except psutil.AccessDenied:
+                pass
+        return {
+            "processes": len(pids),
+            "top_cpu": heapq.nlargest(self.top_n, rows, key=lambda row: row["cpu"]),
+            "top_memory": heapq.nlargest(self.top_n, rows, key=lambda row: row["rss"]),
+        }
+
+
+def _offer(queue: asyncio.Queue, snapshot: Snapshot) -> None:
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(snapshot)
@@ -0,0 +1,82 @@
+"""Websocket frame encodings: full JSON, delta patches and MessagePack."""
+
+import json
+from typing import Any, Dict, Optional, Union
+
+# Optional: MessagePack for binary frames
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+_MISSING = object()
+
+
+def pack(message: Any) -> Union[str, bytes]:
+    """MessagePack bytes when available, JSON text otherwise."""
+    return msgpack.packb(message) if MSGPACK_AVAILABLE else json.dumps(message)
+
+
+def unpack(data: Union[str, bytes]) -> Any:
+    if isinstance(data, str):
+        return json.loads(data)
+    if not MSGPACK_AVAILABLE:
+        raise ValueError("binary frames need msgpack")
+    return msgpack.unpackb(data)
+
+
+def diff(old: Dict, new: Dict) -> Dict:
+    """JSON merge patch (RFC 7386) turning ``old`` into ``new``.
+
+    Only changed leaves are included; removed keys map to ``None`` and lists
+    are replaced whole.
+    """
+    patch: Dict[str, Any] = {}
+    for key, value in new.items():
+        before = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(before, dict):
+            nested = diff(before, value)
+            if nested:
+                patch[key] = nested
+        elif value != before:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+class Frame:
+    """One sample in every wire format, each encoded at most once.
+
+    The plain JSON encoding is the original ``{"metrics", "analysis"}``
+    message. Delta-mode clients get ``{"type": "snapshot", "seq", "data"}``
+    when they start or have missed a frame, and ``{"type": "delta", "seq",
+    "patch"}`` otherwise.
+    """
+
+    __slots__ = ("seq", "data", "_prev", "_patch", "_encoded")
+
+    def __init__(self, seq: int, data: Dict, prev: Optional[Dict] = None):
+        self.seq = seq
+        self.data = data
+        self._prev = prev
+        self._patch: Optional[Dict] = None
+        self._encoded: Dict = {}
+
+    def encode(self, delta: bool = False, full: bool = True, binary: bool = False) -> Union[str, bytes]:
+        full = full or self._prev is None
+        key = (delta, full, binary)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            if not delta:
+                message = self.data
+            elif full:
+                message = {"type": "snapshot", "seq": self.seq, "data": self.data}
+            else:
+                if self._patch is None:
+                    self._patch = diff(self._prev, self.data)
+                message = {"type": "delta", "seq": self.seq, "patch": self._patch}
+            encoded = self._encoded[key] = msgpack.packb(message) if binary else json.dumps(message)
+        return encoded
@@ -0,0 +1,273 @@
+"""Fixed-memory metric history at several resolutions.
+
+Every resolution is a ring of buckets in one flat ``array('d')``. A row
+holds the bucket start, the sample count and, for every field, the count of
+finite values and their mean/min/max, so a sample updates each resolution in
+place and rollups never rescan raw data. Missing (NaN) values are skipped
+rather than poisoning the bucket. With a ``path`` every finished bucket is appended to a file that is
+replayed on startup and compacted to the current ring contents once it
+grows too large.
+"""
+
+import json
+import math
+import os
+import struct
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# (bucket seconds, buckets kept): 1 hour raw, 1 day of minutes, 30 days of hours
+RESOLUTIONS = ((2.0, 1800), (60.0, 1440), (3600.0, 720))
+FIELDS = (
+    "cpu",
+    "memory.percent",
+    "swap.percent",
+    "disk.percent",
+    "net_rate.bytes_sent",
+    "net_rate.bytes_recv",
+    "disk_io.read_bytes",
+    "disk_io.write_bytes",
+    "processes",
+)
+MAX_POINTS = 2000
+MAGIC = b"MTS2\n"
+# rewrite the history file once it is this many times the ring contents
+COMPACT_RATIO = 4
+
+
+def flatten(metrics: Dict, fields: Sequence[str] = FIELDS) -> List[float]:
+    """Pick ``fields`` (dotted paths) out of a ``gather_metrics`` result."""
+    values = []
+    for path in fields:
+        value = metrics
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        values.append(float(value) if value is not None else math.nan)
+    return values
+
+
+class Ring:
+    """Buckets of ``step`` seconds; bucket ``n`` lives in row ``n % capacity``."""
+
+    def __init__(self, step: float, capacity: int, width: int):
+        self.step = step
+        self.capacity = capacity
+        self.width = width
+        self.row = 2 + 4 * width
+        self.data = array("d", [math.nan]) * (capacity * self.row)
+        self.current = -1
+
+    def _base(self, index: int) -> int:
+        return (index % self.capacity) * self.row
+
+    def has(self, index: int) -> bool:
+        return self.data[self._base(index)] == index * self.step
+
+    def add(self, ts: float, values: Sequence[float]) -> Optional[int]:
+        """Fold a sample in; return the index of the bucket it finished, if any."""
+        index = int(ts // self.step)
+        if index <= self.current - self.capacity:
+            # older than the ring reaches; its slot holds a newer bucket
+            return None
+        data = self.data
+        base = self._base(index)
+        if data[base] != index * self.step:
+            data[base] = index * self.step
+            data[base + 1] = 1
+            for i, value in enumerate(values):
+                col = base + 2 + 4 * i
+                if math.isfinite(value):
+                    data[col] = 1
+                    data[col + 1] = data[col + 2] = data[col + 3] = value
+                else:
+                    data[col] = 0
+                    data[col + 1] = data[col + 2] = data[col + 3] = math.nan
+        else:
+            data[base + 1] += 1
+            for i, value in enumerate(values):
+                if not math.isfinite(value):
+                    continue
+                col = base + 2 + 4 * i
+                count = data[col] + 1
+                data[col] = count
+                if count == 1:
+                    data[col + 1] = data[col + 2] = data[col + 3] = value
+                    continue
+                data[col + 1] += (value - data[col + 1]) / count
+                if value < data[col + 2]:
+                    data[col + 2] = value
+                if value > data[col + 3]:
+                    data[col + 3] = value
+        if index <= self.current:
+            return None
+        finished = self.current if self.current >= 0 else None
+        self.current = index
+        return finished
+
+    def get(self, index: int) -> Tuple[float, ...]:
+        base = self._base(index)
+        return tuple(self.data[base:base + self.row])
+
+    def put(self, row: Sequence[float]) -> None:
+        index = int(row[0] // self.step)
+        base = self._base(index)
+        self.data[base:base + self.row] = array("d", row)
+        self.current = max(self.current, index)
+
+    def oldest(self) -> float:
+        return (self.current - self.capacity + 1) * self.step
+
+    def rows(self) -> Iterable[Tuple[float, ...]]:
+        for index in range(self.current - self.capacity + 1, self.current + 1):
+            if self.has(index):
+                yield self.get(index)
+
+
+class MetricHistory:
+    """Rings for every resolution, with optional append-only persistence."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        fields: Sequence[str] = FIELDS,
+        resolutions: Sequence[Tuple[float, int]] = RESOLUTIONS,
+    ):
+        self.fields = tuple(fields)
+        self.rings = [Ring(step, capacity, len(self.fields)) for step, capacity in resolutions]
+        self.path = path
+        self._record = struct.Struct(f"<B{2 + 4 * len(self.fields)}d")
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            self._load()
+            self._compact()
+
+    def add(self, ts: float, metrics: Dict) -> None:
+        self.add_values(ts, flatten(metrics, self.fields))
+
+    def add_values(self, ts: float, values: Sequence[float]) -> None:
+        """Fold in one sample given as a value per field, in ``fields`` order."""
+        with self._lock:
+            for level, ring in enumerate(self.rings):
+                finished = ring.add(ts, values)
+                if finished is not None and self._file is not None:
+                    self._file.write(self._record.pack(level, *ring.get(finished)))
+            if self._file is not None:
+                self._file.flush()
+                if self._file.tell() > COMPACT_RATIO * self._snapshot_size():
+                    self._compact()
+
+    def query(self, start: float, end: float, step: float = 0.0) -> Dict:
+        """Mean/min/max of every field between ``start`` and ``end``.
+
+        Uses the coarsest resolution not coarser than ``step``, or a coarser
+        one if it no longer reaches back to ``start``. Its buckets are merged
+        when ``step`` spans several of them; ``step`` is raised so that at
+        most ``MAX_POINTS`` points are returned.
+        """
+        step = max(step, (end - start) / MAX_POINTS)
+        with self._lock:
+            level = 0
+            while level + 1 < len(self.rings) and self.rings[level + 1].step <= step:
+                level += 1
+            # one bucket of slack so "the last hour" still fits an hour-long ring
+            while level + 1 < len(self.rings) and self.rings[level].oldest() - self.rings[level].step > start:
+                level += 1
+            ring = self.rings[level]
+            per = max(1, int(step // ring.step))
+            # only buckets the ring can still hold, however wide the requested range
+            first = max(int(start // ring.step), ring.current - ring.capacity + 1)
+            last = min(int(end // ring.step), ring.current)
+            rows = [ring.get(index) for index in range(first, last + 1) if ring.has(index)]
+        merged = self._merge(rows, ring.step * per)
+        series = {
+            name: {
+                "mean": [row[3 + 4 * i] for row in merged],
+                "min": [row[4 + 4 * i] for row in merged],
+                "max": [row[5 + 4 * i] for row in merged],
+            }
+            for i, name in enumerate(self.fields)
+        }
+        return {
+            "from": start,
+            "to": end,
+            "step": ring.step * per,
+            "t": [row[0] for row in merged],
+            "count": [int(row[1]) for row in merged],
+            "series": _without_nan(series),
+        }
+
+    def _merge(self, rows: List[Tuple[float, ...]], step: float) -> List[List[float]]:
+        merged: List[List[float]] = []
+        for row in rows:
+            start = row[0] // step * step
+            if not merged or merged[-1][0] != start:
+                merged.append([start] + list(row[1:]))
+                continue
+            out = merged[-1]
+            out[1] += row[1]
+            for i in range(len(self.fields)):
+                col = 2 + 4 * i
+                if not row[col]:
+                    continue
+                total = out[col] + row[col]
+                if not out[col]:
+                    out[col:col + 4] = row[col:col + 4]
+                    continue
+                out[col + 1] += (row[col + 1] - out[col + 1]) * row[col] / total
+                out[col + 2] = min(out[col + 2], row[col + 2])
+                out[col + 3] = max(out[col + 3], row[col + 3])
+                out[col] = total
+        return merged
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._compact()
+                self._file.close()
+                self._file = None
+
+    def _snapshot_size(self) -> int:
+        return len(self._header()) + self._record.size * sum(ring.capacity for ring in self.rings)
+
+    def _header(self) -> bytes:
+        steps = [ring.step for ring in self.rings]
+        return MAGIC + json.dumps({"fields": self.fields, "steps": steps}).encode() + b"\n"
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as fh:
+            data = fh.read()
+        header = self._header()
+        if not data.startswith(header):
+            # written with other fields or resolutions; start over
+            return
+        size = self._record.size
+        end = len(data) - (len(data) - len(header)) % size
+        for offset in range(len(header), end, size):
+            level, *row = self._record.unpack_from(data, offset)
+            if level < len(self.rings):
+                self.rings[level].put(row)
+
+    def _compact(self) -> None:
+        """Rewrite the file as the current ring contents and keep appending to it."""
+        if self._file is not None:
+            self._file.close()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(self._header())
+            for level, ring in enumerate(self.rings):
+                for row in ring.rows():
+                    fh.write(self._record.pack(level, *row))
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "ab")
+
+
+def _without_nan(series: Dict) -> Dict:
+    # JSON has no NaN; fields missing on this host become null
+    return {
+        name: {k: [None if v != v else v for v in values] for k, values in stats.items()}
+        for name, stats in series.items()
+    }
@@ -0,0 +1,80 @@
+"""Fan-out of published frames to websocket subscribers."""
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, Set
+
+HUB_QUEUE = 4
+MAX_LAG = 15
+
+_CLOSED = object()
+
+
+class Subscription:
+    """Frames waiting for one client.
+
+    The queue holds the newest ``HUB_QUEUE`` frames: when the client cannot
+    keep up the oldest pending frame is dropped, so it always catches up on
+    the latest state. A client that misses ``max_lag`` frames in a row
+    without reading is evicted.
+    """
+
+    __slots__ = ("queue", "lagging", "dropped", "evicted")
+
+    def __init__(self, size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.lagging = 0
+        self.dropped = 0
+        self.evicted = False
+
+    def offer(self, frame: Any, max_lag: int) -> bool:
+        """Queue ``frame``; return ``False`` once the subscriber should be evicted."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.lagging += 1
+            if self.lagging >= max_lag:
+                self.close()
+                self.evicted = True
+                return False
+        self.queue.put_nowait(frame)
+        return True
+
+    def close(self) -> None:
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        while True:
+            frame = await self.queue.get()
+            if frame is _CLOSED:
+                return
+            self.lagging = 0
+            yield frame
+
+
+class Hub:
+    """Publishes each frame once to every current subscriber."""
+
+    def __init__(self, queue_size: int = HUB_QUEUE, max_lag: int = MAX_LAG):
+        self.queue_size = queue_size
+        self.max_lag = max_lag
+        self.subscribers: Set[Subscription] = set()
+        self.stats: Dict[str, int] = {"published": 0, "dropped": 0, "evicted": 0}
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self.queue_size)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self.subscribers.discard(sub)
+
+    def publish(self, frame: Any) -> None:
+        self.stats["published"] += 1
+        for sub in list(self.subscribers):
+            dropped = sub.dropped
+            if not sub.offer(frame, self.max_lag):
+                self.stats["evicted"] += 1
+                self.unsubscribe(sub)
+            self.stats["dropped"] += sub.dropped - dropped
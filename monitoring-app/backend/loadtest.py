@@ -0,0 +1,329 @@
+"""Load test for the monitoring API with a stubbed Ollama.
+
+Usage::
+
+    python loadtest.py                      # starts its own backend and stub model
+    python loadtest.py --steps 100,200,400 --duration 20
+    python loadtest.py --url http://monitor:8000 --username admin --password ...
+
+Each step runs that many concurrent clients for ``--duration`` seconds: a
+``--ws-share`` of them keep a ``/ws/metrics`` stream open, the rest poll the
+REST API with ``--think`` seconds between requests. Per step it reports
+REST latency, websocket handshake latency and the gap between streamed
+frames (p50/p99). ``/api/analysis`` waits for the model whenever its cache
+is stale, so it is reported on its own and left out of the REST figures.
+A step is sustainable when nothing failed, REST p99 is within ``--p99``
+milliseconds and frames arrive no more than twice the
+sample interval apart; the run stops at the first step that is not.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import websockets
+
+# Optional: lift the open-files limit for many sockets (POSIX only)
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+STEPS = "50,100,200,400,800"
+STEP_DURATION = 15.0
+WS_SHARE = 0.5
+THINK_TIME = 1.0
+P99_LIMIT = 250.0
+OLLAMA_LATENCY = 1.0
+REQUEST_TIMEOUT = 30.0
+# weighted REST mix; /api/analysis is cached, the others hit the collector and history
+REST_MIX = (("/api/metrics", 8), ("/api/metrics/history", 1), ("/api/analysis", 1))
+MODEL_PATHS = ("/api/analysis",)
+
+
+class StubOllama:
+    """Answers every ``/api/generate`` call after ``latency`` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/api/generate"
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        # the backend's client keeps its connections open; end them so the handlers return
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                self.calls += 1
+                await asyncio.sleep(self.latency)
+                body = json.dumps({"response": "stub analysis: all metrics look normal"}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+
+class StepStats:
+    def __init__(self):
+        self.rest: List[float] = []
+        self.analysis: List[float] = []
+        self.connect: List[float] = []
+        self.gaps: List[float] = []
+        self.errors: Dict[str, int] = {}
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection, as a dashboard's browser would hold.
+
+    Much cheaper per request than a pooled client, so the load generator
+    does not become the bottleneck before the server does.
+    """
+
+    def __init__(self, url: str, token: str):
+        parsed = urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.headers = f"Host: {parsed.netloc}\r\nAuthorization: Bearer {token}\r\n\r\n".encode()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self, path: str) -> int:
+        """The response status; the body is read and discarded."""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self._writer.write(f"GET {path} HTTP/1.1\r\n".encode() + self.headers)
+            head = await self._reader.readuntil(b"\r\n\r\n")
+            lines = head.split(b"\r\n")
+            length = None
+            for line in lines[1:]:
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            if length is None:
+                raise ConnectionError("response without Content-Length")
+            await self._reader.readexactly(length)
+            return int(lines[0].split()[1])
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def rest_client(url: str, token: str, stats: StepStats, until: float, think: float):
+    paths = [path for path, _ in REST_MIX]
+    weights = [weight for _, weight in REST_MIX]
+    connection = Connection(url, token)
+    # spread the first requests over one think time
+    await asyncio.sleep(random.uniform(0, think))
+    try:
+        while time.monotonic() < until:
+            path = random.choices(paths, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(connection.get(path), REQUEST_TIMEOUT)
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                stats.error(type(e).__name__)
+            else:
+                if status == 200:
+                    latencies = stats.analysis if path in MODEL_PATHS else stats.rest
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    stats.error(f"HTTP {status}")
+            await asyncio.sleep(think)
+    finally:
+        connection.close()
+
+
+async def ws_client(url: str, token: str, stats: StepStats, until: float, ramp: float):
+    await asyncio.sleep(random.uniform(0, ramp))
+    started = time.perf_counter()
+    try:
+        async with websockets.connect(f"{url}/ws/metrics?delta=1&token={token}", open_timeout=REQUEST_TIMEOUT) as ws:
+            stats.connect.append(time.perf_counter() - started)
+            last = None
+            while True:
+                remaining = until - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(ws.recv(), remaining)
+                except asyncio.TimeoutError:
+                    return
+                now = time.monotonic()
+                if last is not None:
+                    stats.gaps.append(now - last)
+                last = now
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+        stats.error(type(e).__name__)
+
+
+async def run_step(url: str, token: str, clients: int, args) -> StepStats:
+    stats = StepStats()
+    sockets = int(round(clients * args.ws_share))
+    ws_url = "ws" + url[len("http"):]
+    until = time.monotonic() + args.duration
+    tasks = [ws_client(ws_url, token, stats, until, args.think) for _ in range(sockets)]
+    tasks += [rest_client(url, token, stats, until, args.think) for _ in range(clients - sockets)]
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def sustainable(stats: StepStats, args) -> bool:
+    if stats.errors:
+        return False
+    if stats.rest and percentile(stats.rest, 0.99) * 1000 > args.p99:
+        return False
+    return not stats.gaps or percentile(stats.gaps, 0.99) <= 2 * args.sample_interval
+
+
+def report(clients: int, stats: StepStats, args, ok: bool) -> str:
+    def ms(values: List[float], q: float) -> str:
+        return f"{percentile(values, q) * 1000:8.1f}"
+
+    errors = ",".join(f"{kind}={count}" for kind, count in stats.errors.items()) or "-"
+    return (
+        f"{clients:7d} {(len(stats.rest) + len(stats.analysis)) / args.duration:8.1f}"
+        f" {ms(stats.rest, 0.5)} {ms(stats.rest, 0.99)} {ms(stats.analysis, 0.99)} "
+        f" {ms(stats.connect, 0.5)} {ms(stats.connect, 0.99)} {ms(stats.gaps, 0.5)} {ms(stats.gaps, 0.99)}"
+        f"  {'yes' if ok else 'no ':3s}  {errors}"
+    )
+
+
+def start_backend(port: int, ollama_url: str, args) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        OLLAMA_URL=ollama_url,
+        ADMIN_USER=args.username,
+        ADMIN_PASS=args.password,
+        SAMPLE_INTERVAL=str(args.sample_interval),
+        STREAM_ANALYSIS="1",
+        HISTORY_FILE="",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+
+
+async def login(url: str, username: str, password: str, wait: float) -> str:
+    deadline = time.monotonic() + wait
+    async with httpx.AsyncClient(base_url=url, timeout=10) as client:
+        while True:
+            try:
+                response = await client.post("/api/login", params={"username": username, "password": password})
+                response.raise_for_status()
+                return response.json()["access_token"]
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+def raise_file_limit() -> None:
+    if RESOURCE_AVAILABLE:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def run(args) -> int:
+    stub = StubOllama(args.ollama_latency)
+    backend = None
+    url = args.url
+    if url is None:
+        url = f"http://127.0.0.1:{args.port}"
+        backend = start_backend(args.port, await stub.start(), args)
+    try:
+        token = await login(url, args.username, args.password, wait=30)
+        print(f"{'clients':>7} {'req/s':>8} {'rest p50':>8} {'rest p99':>8} {'model p99':>9} {'ws p50':>8} {'ws p99':>8}"
+              f" {'gap p50':>8} {'gap p99':>8}  ok   errors")
+        best = 0
+        for clients in (int(step) for step in args.steps.split(",")):
+            stats = await run_step(url, token, clients, args)
+            ok = sustainable(stats, args)
+            print(report(clients, stats, args, ok), flush=True)
+            if not ok:
+                break
+            best = clients
+        print(f"max sustainable clients: {best}" + (f" (stub model calls: {stub.calls})" if backend else ""))
+        return best
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+        await stub.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Backend to test, e.g. http://monitor:8000 (default: start one)")
+    parser.add_argument("--port", type=int, default=18000, help="Port for the backend started by the test")
+    parser.add_argument("--username", default=os.getenv("ADMIN_USER", "admin"))
+    parser.add_argument("--password", default=os.getenv("ADMIN_PASS", "password"))
+    parser.add_argument("--steps", default=STEPS, help="Comma-separated client counts")
+    parser.add_argument("--duration", type=float, default=STEP_DURATION, help="Seconds per step")
+    parser.add_argument("--ws-share", type=float, default=WS_SHARE, help="Fraction of clients on websockets")
+    parser.add_argument("--think", type=float, default=THINK_TIME, help="Seconds between a REST client's requests")
+    parser.add_argument("--p99", type=float, default=P99_LIMIT, help="REST p99 limit in milliseconds")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Backend SAMPLE_INTERVAL")
+    parser.add_argument("--ollama-latency", type=float, default=OLLAMA_LATENCY, help="Stub model latency")
+    args = parser.parse_args()
+    raise_file_limit()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
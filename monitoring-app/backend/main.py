@@ -1,25 +1,69 @@
 import os
+import hmac
 import json
+import math
+import time
 import asyncio
+import logging
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, Optional, Set
 
-import psutil
 import jwt
-import requests
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.websockets import WebSocketState
 from dotenv import load_dotenv
 
+from aggregator import FLEET_INTERVAL, MAX_HOSTS, Fleet
+from auth import TOKEN_CACHE, TokenCache
+from alerts import AlertEngine, describe, load_rules
+from analysis import ANALYSIS_MIN_INTERVAL, ANALYSIS_THRESHOLDS, ANALYSIS_TTL, CachedAnalysis, parse_thresholds
+from collector import Collector
+from frames import MSGPACK_AVAILABLE, Frame, unpack
+from history import MetricHistory, flatten
+from hub import Hub
+from ollama_client import close_client, get_client
+
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "change_this_secret")
 JWT_ALGORITHM = "HS256"
 TOKEN_EXPIRE_MINUTES = 30
+SAMPLE_INTERVAL = float(os.getenv("SAMPLE_INTERVAL", "2"))
+AGENT_TOKEN = os.getenv("AGENT_TOKEN", "")
+# periodic model analysis in every frame; by default the model only explains alerts
+STREAM_ANALYSIS = os.getenv("STREAM_ANALYSIS", "0") == "1"
+EXPLAIN_COOLDOWN = float(os.getenv("EXPLAIN_COOLDOWN", "300"))
+ALERT_QUEUE = 256
+
+collector = Collector(SAMPLE_INTERVAL)
+hub = Hub()
+history = MetricHistory(os.getenv("HISTORY_FILE") or None)
+alert_engine = AlertEngine(load_rules(os.getenv("ALERT_RULES_FILE")))
+alerts_hub = Hub(queue_size=ALERT_QUEUE)
+fleet = Fleet(max_hosts=int(os.getenv("MAX_HOSTS", MAX_HOSTS)))
+# running explain_alert tasks; the loop itself only keeps weak references
+explain_tasks: Set[asyncio.Task] = set()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    collector.start()
+    tasks = [asyncio.create_task(sample_metrics())]
+    if AGENT_TOKEN:
+        tasks.append(asyncio.create_task(rollup_fleet()))
+    yield
+    for task in tasks + list(explain_tasks):
+        task.cancel()
+    collector.stop()
+    await close_client()
+    history.close()
 
-app = FastAPI(title="Debian Monitoring App")
+
+app = FastAPI(title="Debian Monitoring App", lifespan=lifespan)
 
 # Simple CORS
 app.add_middleware(
@@ -31,6 +75,7 @@ app.add_middleware(
 )
 
 security = HTTPBearer()
+tokens = TokenCache(SECRET_KEY, JWT_ALGORITHM, int(os.getenv("TOKEN_CACHE", TOKEN_CACHE)))
 
 
 def create_access_token(data: Dict) -> str:
@@ -43,12 +88,35 @@ def create_access_token(data: Dict) -> str:
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        payload = tokens.verify(token)
     except jwt.PyJWTError as e:
         raise HTTPException(status_code=401, detail="Invalid token") from e
     return payload
 
 
+def verify_websocket(ws: WebSocket) -> Optional[Dict]:
+    """The payload of the handshake's token, from ``?token=`` or a bearer header."""
+    token = ws.query_params.get("token")
+    if token is None:
+        scheme, _, token = ws.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer":
+            return None
+    try:
+        return tokens.verify(token)
+    except jwt.PyJWTError:
+        return None
+
+
+async def accept_authenticated(ws: WebSocket) -> bool:
+    """Accept a dashboard socket, or close it with 1008 when its token is missing or invalid."""
+    valid = verify_websocket(ws) is not None
+    # browsers only see a close code after the handshake, so refuse after accepting
+    await ws.accept()
+    if not valid:
+        await ws.close(code=1008)
+    return valid
+
+
 @app.post("/api/login")
 async def login(username: str, password: str):
     # Replace with real authentication logic
@@ -58,61 +126,261 @@ async def login(username: str, password: str):
     raise HTTPException(status_code=401, detail="Incorrect credentials")
 
 
-def gather_metrics() -> Dict:
-    return {
-        "cpu": psutil.cpu_percent(interval=None),
-        "memory": psutil.virtual_memory()._asdict(),
-        "swap": psutil.swap_memory()._asdict(),
-        "disk": psutil.disk_usage("/")._asdict(),
-        "net": psutil.net_io_counters()._asdict(),
-        "processes": len(psutil.pids()),
-    }
+async def gather_metrics() -> Dict:
+    """The collector's latest snapshot; psutil itself never runs on the event loop."""
+    snapshot = collector.latest
+    if snapshot is None:
+        snapshot = await asyncio.to_thread(collector.wait_ready, 2 * SAMPLE_INTERVAL)
+    return snapshot.metrics if snapshot is not None else {}
 
 
 async def analyze_with_ollama(metrics: Dict) -> Dict:
     """Send metrics to the Ollama REST API using phi4.1 model."""
-    url = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
-    payload = {
-        "model": "phi4.1:latest",
-        "prompt": json.dumps(metrics),
-    }
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException:
-        return {"error": "Failed to contact Ollama API"}
+    return await get_client().generate(json.dumps(metrics))
+
+
+analyzer = CachedAnalysis(
+    analyze_with_ollama,
+    ttl=float(os.getenv("ANALYSIS_TTL", ANALYSIS_TTL)),
+    min_interval=float(os.getenv("ANALYSIS_MIN_INTERVAL", ANALYSIS_MIN_INTERVAL)),
+    thresholds=parse_thresholds(os.getenv("ANALYSIS_THRESHOLDS", ANALYSIS_THRESHOLDS)),
+)
 
 
 @app.get("/api/metrics")
 async def get_metrics(user=Depends(verify_token)):
-    metrics = gather_metrics()
+    metrics = await gather_metrics()
     return {"metrics": metrics}
 
 
+@app.get("/api/metrics/history")
+async def get_metrics_history(
+    start: Optional[float] = Query(None, alias="from"),
+    end: Optional[float] = Query(None, alias="to"),
+    step: float = 0.0,
+    user=Depends(verify_token),
+):
+    """Mean/min/max per field between two Unix timestamps (default: the last hour)."""
+    return query_history(history, start, end, step)
+
+
+def query_history(store: MetricHistory, start: Optional[float], end: Optional[float], step: float) -> Dict:
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    if not all(math.isfinite(value) for value in (start, end, step)) or step < 0:
+        raise HTTPException(status_code=400, detail="'from', 'to' and 'step' must be finite, 'step' not negative")
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    return store.query(start, end, step)
+
+
+async def sample_metrics():
+    """Pass each collector snapshot into the history and out to all websocket clients.
+
+    Every sample is checked by the alert engine. With ``STREAM_ANALYSIS``
+    frames also carry the latest finished analysis; the analyzer is consulted
+    again whenever the previous call is done, so a slow model never delays
+    the metrics, and only while dashboards are connected.
+    """
+    updates = collector.watch(asyncio.get_running_loop())
+    analysis: Dict = {}
+    pending = None
+    seq = 0
+    previous = None
+    last_explained: Dict[str, float] = {}
+    while True:
+        snapshot = await updates.get()
+        metrics = snapshot.metrics
+        values = flatten(metrics, history.fields)
+        history.add_values(snapshot.ts, values)
+        for event in alert_engine.evaluate(snapshot.ts, values):
+            alerts_hub.publish(json.dumps({"type": "alert", **event}))
+            if event["state"] == "firing" and snapshot.ts - last_explained.get(event["rule"], 0.0) >= EXPLAIN_COOLDOWN:
+                last_explained[event["rule"]] = snapshot.ts
+                task = asyncio.create_task(explain_alert(event, metrics))
+                explain_tasks.add(task)
+                task.add_done_callback(_explain_done)
+        if not hub.subscribers:
+            continue
+        if STREAM_ANALYSIS:
+            if pending is not None and pending.done():
+                analysis = pending.result()
+                pending = None
+            if pending is None:
+                pending = asyncio.create_task(analyzer.analyze(metrics))
+        seq += 1
+        data = {"metrics": metrics, "analysis": analysis}
+        hub.publish(Frame(seq, data, previous))
+        previous = data
+
+
+def _explain_done(task: asyncio.Task):
+    explain_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("explaining alert failed", exc_info=task.exception())
+
+
+async def explain_alert(alert: Dict, metrics: Dict):
+    """Ask the model why ``alert`` fired, given the metrics and the field's last 15 minutes."""
+    recent = history.query(alert["ts"] - 900, alert["ts"], 60)
+    prompt = (
+        "A monitoring alert fired on a Debian host. Explain the likely cause in a few sentences "
+        "and suggest what to check first.\n"
+        + json.dumps({
+            "alert": alert,
+            "metrics": metrics,
+            "recent": {"t": recent["t"], alert["field"]: recent["series"][alert["field"]]},
+        })
+    )
+    result = await get_client().generate(prompt)
+    explanation = result.get("response", result)
+    for active in alert_engine.active():
+        if active["id"] == alert["id"]:
+            active["explanation"] = explanation
+    alerts_hub.publish(json.dumps({"type": "explanation", "id": alert["id"], "rule": alert["rule"],
+                                   "explanation": explanation}))
+
+
+async def forward_frames(ws: WebSocket, sub, delta: bool, binary: bool):
+    last = None
+    try:
+        async for frame in sub:
+            # a delta only applies on top of the frame right before it
+            payload = frame.encode(delta, full=last is None or frame.seq != last + 1, binary=binary)
+            last = frame.seq
+            if binary:
+                await ws.send_bytes(payload)
+            else:
+                await ws.send_text(payload)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
+
+async def wait_for_disconnect(ws: WebSocket):
+    while (await ws.receive())["type"] != "websocket.disconnect":
+        pass
+
+
 @app.websocket("/ws/metrics")
-async def websocket_metrics(ws: WebSocket):
+async def websocket_metrics(ws: WebSocket, delta: bool = False, encoding: str = "json"):
+    """Stream frames; ``?delta=1`` opts into snapshot + patch frames, ``?encoding=msgpack`` into binary ones."""
+    if encoding not in ("json", "msgpack") or (encoding == "msgpack" and not MSGPACK_AVAILABLE):
+        await ws.close(code=1003)
+        return
+    if not await accept_authenticated(ws):
+        return
+    sub = hub.subscribe()
+    sender = asyncio.create_task(forward_frames(ws, sub, delta, encoding == "msgpack"))
+    receiver = asyncio.create_task(wait_for_disconnect(ws))
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        hub.unsubscribe(sub)
+        sender.cancel()
+        receiver.cancel()
+    if sub.evicted and ws.application_state != WebSocketState.DISCONNECTED:
+        # too slow to keep up; the client may reconnect
+        await ws.close(code=1013)
+
+
+async def forward_text(ws: WebSocket, sub):
+    try:
+        async for frame in sub:
+            await ws.send_text(frame)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
+
+@app.websocket("/ws/alerts")
+async def websocket_alerts(ws: WebSocket):
+    """The active alerts on connect, then firing/resolved events and model explanations."""
+    if not await accept_authenticated(ws):
+        return
+    sub = alerts_hub.subscribe()
+    await ws.send_text(json.dumps({"type": "active", "alerts": alert_engine.active()}))
+    sender = asyncio.create_task(forward_text(ws, sub))
+    receiver = asyncio.create_task(wait_for_disconnect(ws))
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        alerts_hub.unsubscribe(sub)
+        sender.cancel()
+        receiver.cancel()
+
+
+@app.get("/api/alerts")
+async def get_alerts(user=Depends(verify_token)):
+    return {"active": alert_engine.active(), "rules": describe(alert_engine.rules)}
+
+
+@app.websocket("/ws/ingest")
+async def ingest_agent(ws: WebSocket):
+    """Receive batched samples from ``agent.py``, authenticated by ``AGENT_TOKEN``."""
+    expected = f"Bearer {AGENT_TOKEN}"
+    if not AGENT_TOKEN or not hmac.compare_digest(ws.headers.get("authorization", ""), expected):
+        await ws.close(code=1008)
+        return
     await ws.accept()
+    series = None
     try:
         while True:
-            metrics = gather_metrics()
-            analysis = await analyze_with_ollama(metrics)
-            data = {"metrics": metrics, "analysis": analysis}
-            await ws.send_text(json.dumps(data))
-            await asyncio.sleep(2)
-    except WebSocketDisconnect:
-        if ws.application_state != WebSocketState.DISCONNECTED:
-            await ws.close()
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = unpack(message["bytes"] if message.get("bytes") is not None else message["text"])
+            if data["type"] == "hello":
+                series = fleet.register(str(data["host"]), data["fields"])
+            elif data["type"] == "samples" and series is not None:
+                fleet.ingest(series, data["samples"])
+    except (ValueError, TypeError, KeyError, IndexError):
+        await ws.close(code=1003)
+
+
+async def rollup_fleet():
+    while True:
+        await asyncio.sleep(FLEET_INTERVAL)
+        fleet.rollup()
+
+
+@app.get("/api/hosts")
+async def get_hosts(user=Depends(verify_token)):
+    return {"hosts": fleet.summary()}
+
+
+@app.get("/api/hosts/{host}/history")
+async def get_host_history(
+    host: str,
+    start: Optional[float] = Query(None, alias="from"),
+    end: Optional[float] = Query(None, alias="to"),
+    step: float = 0.0,
+    user=Depends(verify_token),
+):
+    series = fleet.hosts.get(host)
+    if series is None:
+        raise HTTPException(status_code=404, detail="Unknown host")
+    return query_history(series.history, start, end, step)
+
+
+@app.get("/api/fleet/history")
+async def get_fleet_history(
+    start: Optional[float] = Query(None, alias="from"),
+    end: Optional[float] = Query(None, alias="to"),
+    step: float = 0.0,
+    user=Depends(verify_token),
+):
+    """Across-host mean and max of every field, as ``<field>.mean`` / ``<field>.max`` series."""
+    return query_history(fleet.history, start, end, step)
 
 
 @app.get("/api/analysis")
 async def get_analysis(user=Depends(verify_token)):
-    metrics = gather_metrics()
-    analysis = await analyze_with_ollama(metrics)
+    metrics = await gather_metrics()
+    analysis = await analyzer.analyze(metrics)
     return {"analysis": analysis}
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # browsers offer permessage-deflate; compress frames for the clients that do
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=True)
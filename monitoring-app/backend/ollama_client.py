@@ -0,0 +1,78 @@
+"""Shared async client for the Ollama REST API."""
+
+import asyncio
+import os
+from typing import Dict, Optional
+
+import httpx
+
+OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_MODEL = "phi4.1:latest"
+OLLAMA_TIMEOUT = 10.0
+OLLAMA_CONCURRENCY = 4
+
+
+class OllamaClient:
+    """Keep-alive connection pool with a cap on concurrent generations.
+
+    Requests beyond ``concurrency`` wait on a semaphore without blocking the
+    event loop; a request that cannot start or finish within ``timeout``
+    seconds returns an error instead of holding up its caller.
+    """
+
+    def __init__(
+        self,
+        url: str = OLLAMA_URL,
+        model: str = OLLAMA_MODEL,
+        timeout: float = OLLAMA_TIMEOUT,
+        concurrency: int = OLLAMA_CONCURRENCY,
+    ):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 3.0)),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    async def generate(self, prompt: str, **options) -> Dict:
+        payload = {"model": self.model, "prompt": prompt, "stream": False, **options}
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return {"error": "Ollama API busy"}
+        try:
+            response = await self._client.post(self.url, json=payload)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError):
+            return {"error": "Failed to contact Ollama API"}
+        finally:
+            self._slots.release()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_client: Optional[OllamaClient] = None
+
+
+def get_client() -> OllamaClient:
+    """The process-wide client, created on first use inside the event loop."""
+    global _client
+    if _client is None:
+        _client = OllamaClient(
+            url=os.getenv("OLLAMA_URL", OLLAMA_URL),
+            model=os.getenv("OLLAMA_MODEL", OLLAMA_MODEL),
+            timeout=float(os.getenv("OLLAMA_TIMEOUT", OLLAMA_TIMEOUT)),
+            concurrency=int(os.getenv("OLLAMA_CONCURRENCY", OLLAMA_CONCURRENCY)),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
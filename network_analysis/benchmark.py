@@ -0,0 +1,277 @@
+"""Throughput and latency benchmark for the traffic engine.
+
+Generates synthetic TCP connections in-process, drives ``TrafficEngine``
+against a local stub of the Ollama API and reports packets/sec, flows/sec,
+per-stage latency percentiles and peak RSS.
+
+Usage:
+    python benchmark.py --flows 20000 --packets-per-flow 20
+    python benchmark.py --json > baseline.json
+    python benchmark.py --compare baseline.json --max-regression 0.1
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import resource
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from packets import ACK, FIN, PSH, SYN, PacketRecord
+from traffic_engine import TrafficEngine
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Answers /api/generate with one benign verdict per flow in the prompt."""
+
+    latency = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        prompt = body.get("prompt", "")
+        try:
+            flows = json.loads(prompt[prompt.index("\n") + 1:])
+            count = len(flows) if isinstance(flows, list) else 1
+        except ValueError:
+            count = 1
+        verdicts = [{"label": "benign", "score": 0.0} for _ in range(count)]
+        data = json.dumps({"response": json.dumps(verdicts)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(latency: float) -> ThreadingHTTPServer:
+    handler = type("Handler", (StubOllamaHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_traffic(
+    flows: int,
+    packets_per_flow: int,
+    payload_size: int,
+    concurrency: int,
+    seed: int = 1,
+) -> Iterator[PacketRecord]:
+    """Yield interleaved packets of ``flows`` complete TCP connections.
+
+    ``concurrency`` connections are open at any time; each one does a
+    handshake, exchanges data packets in both directions and closes with FIN.
+    """
+    rng = random.Random(seed)
+    payload = bytes(rng.getrandbits(8) for _ in range(payload_size))
+    ts = 1_700_000_000.0
+    started = 0
+    active: List[List] = []
+    while started < flows or active:
+        while len(active) < concurrency and started < flows:
+            client = f"10.{started >> 16 & 255}.{started >> 8 & 255}.{started & 255}"
+            server = f"192.168.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+            # sequence numbers continue after each direction's SYN
+            active.append([client, 1024 + started % 60000, server, 443, 0, 1, 1])
+            started += 1
+        idx = rng.randrange(len(active))
+        client, cport, server, sport, sent, cseq, sseq = conn = active[idx]
+        ts += 0.0001
+        if sent == 0:
+            rec = PacketRecord(ts, client, server, cport, sport, SYN, 74)
+        elif sent == 1:
+            rec = PacketRecord(ts, server, client, sport, cport, SYN | ACK, 74)
+        elif sent == packets_per_flow - 2:
+            rec = PacketRecord(ts, client, server, cport, sport, FIN | ACK, 66)
+        elif sent == packets_per_flow - 1:
+            rec = PacketRecord(ts, server, client, sport, cport, FIN | ACK, 66)
+        elif sent % 2:
+            rec = PacketRecord(
+                ts, server, client, sport, cport, PSH | ACK, 66 + payload_size, sseq, payload, payload_size
+            )
+            conn[6] += payload_size
+        else:
+            rec = PacketRecord(
+                ts, client, server, cport, sport, PSH | ACK, 66 + payload_size, cseq, payload, payload_size
+            )
+            conn[5] += payload_size
+        conn[4] += 1
+        if conn[4] >= packets_per_flow:
+            active[idx] = active[-1]
+            active.pop()
+        yield rec
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    values = np.percentile(np.asarray(samples) * 1e6, PERCENTILES)
+    return {f"p{p}_us": round(float(v), 2) for p, v in zip(PERCENTILES, values)}
+
+
+def run(args: argparse.Namespace) -> Dict:
+    stub = start_stub(args.model_latency)
+    url = f"http://127.0.0.1:{stub.server_address[1]}/api/generate"
+    records = list(
+        synthetic_traffic(args.flows, args.packets_per_flow, args.payload_size, args.concurrency)
+    )
+
+    reports = []
+    report_latency: List[float] = []
+    finalized_at: Dict[int, float] = {}
+
+    def emit(report: Dict) -> None:
+        start = finalized_at.pop(id(report), None)
+        if start is not None:
+            report_latency.append(time.perf_counter() - start)
+        reports.append(1)
+
+    engine = TrafficEngine(
+        "bench",
+        url,
+        ml_workers=args.ml_workers,
+        ml_batch_size=args.ml_batch_size,
+        ml_policy=args.ml_policy,
+        emit=emit,
+    )
+
+    packet_latency: List[float] = []
+    finalize_latency: List[float] = []
+    model_latency: List[float] = []
+
+    finalize = engine._finalize_flow
+    submit = engine.scoring.submit
+    analyze_batch = engine.ml.analyze_batch
+
+    def timed_finalize(*item):
+        start = time.perf_counter()
+        finalize(*item)
+        finalize_latency.append(time.perf_counter() - start)
+
+    def timed_submit(report):
+        finalized_at[id(report)] = time.perf_counter()
+        submit(report)
+
+    def timed_analyze(batch):
+        start = time.perf_counter()
+        result = analyze_batch(batch)
+        model_latency.append(time.perf_counter() - start)
+        return result
+
+    engine._finalize_flow = timed_finalize
+    engine.scoring.submit = timed_submit
+    engine.ml.analyze_batch = timed_analyze
+
+    process = engine._process_record
+    sample_every = args.sample_every
+    perf = time.perf_counter
+    started = perf()
+    for i, rec in enumerate(records):
+        if i % sample_every:
+            process(rec)
+        else:
+            t0 = perf()
+            process(rec)
+            packet_latency.append(perf() - t0)
+    capture_seconds = perf() - started
+    engine.flush()
+    engine.close()
+    total_seconds = perf() - started
+    stub.shutdown()
+
+    return {
+        "config": {
+            "flows": args.flows,
+            "packets_per_flow": args.packets_per_flow,
+            "payload_size": args.payload_size,
+            "concurrency": args.concurrency,
+            "model_latency": args.model_latency,
+            "ml_workers": args.ml_workers,
+            "ml_batch_size": args.ml_batch_size,
+            "ml_policy": args.ml_policy,
+        },
+        "packets": len(records),
+        "flows": len(reports),
+        "capture_seconds": round(capture_seconds, 4),
+        "total_seconds": round(total_seconds, 4),
+        "packets_per_sec": round(len(records) / capture_seconds, 1),
+        "flows_per_sec": round(len(reports) / total_seconds, 1),
+        "latency": {
+            "process_packet": percentiles(packet_latency),
+            "finalize_flow": percentiles(finalize_latency),
+            "model_request": percentiles(model_latency),
+            "finalize_to_report": percentiles(report_latency),
+        },
+        "scoring": dict(engine.scoring.stats),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def print_summary(result: Dict) -> None:
+    print(
+        f"{result['packets']} packets, {result['flows']} flows in {result['total_seconds']}s"
+        f" (capture {result['capture_seconds']}s)"
+    )
+    print(f"  packets/sec: {result['packets_per_sec']:,.0f}")
+    print(f"  flows/sec:   {result['flows_per_sec']:,.0f}")
+    print(f"  peak RSS:    {result['peak_rss_mb']} MiB")
+    for stage, stats in result["latency"].items():
+        cells = "  ".join(f"{k}={v}" for k, v in stats.items())
+        print(f"  {stage:<20} {cells}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Traffic engine benchmark")
+    parser.add_argument("--flows", type=int, default=20_000, help="Connections to generate")
+    parser.add_argument("--packets-per-flow", type=int, default=20, help="Packets per connection (min 4)")
+    parser.add_argument("--payload-size", type=int, default=512, help="Payload bytes per data packet")
+    parser.add_argument("--concurrency", type=int, default=1000, help="Connections open at once")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Stub Ollama response delay (s)")
+    parser.add_argument("--ml-workers", type=int, default=2)
+    parser.add_argument("--ml-batch-size", type=int, default=16)
+    parser.add_argument("--ml-policy", default="drop", choices=("block", "drop", "sample"))
+    parser.add_argument(
+        "--sample-every", type=int, default=64, help="Time 1 in N packets individually"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    parser.add_argument("--compare", help="Previous --json result to compare packets/sec against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.1,
+        help="Fail if packets/sec drops by more than this fraction versus --compare",
+    )
+    args = parser.parse_args()
+    args.packets_per_flow = max(4, args.packets_per_flow)
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_summary(result)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            previous = json.load(fh)
+        ratio = result["packets_per_sec"] / previous["packets_per_sec"]
+        print(f"packets/sec vs {args.compare}: {ratio:.2%}", file=sys.stderr)
+        if ratio < 1.0 - args.max_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
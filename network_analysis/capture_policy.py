@@ -0,0 +1,229 @@
+"""Capture policy: kernel-side BPF prefilter, snap length and flow sampling.
+
+On Linux, live capture reads an ``AF_PACKET`` socket with the compiled BPF
+program attached. Every accepting ``ret`` instruction of the program is
+rewritten to return ``snaplen``, so the kernel itself truncates packets to
+their headers and only the selected traffic is ever copied into Python.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import socket
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
+
+from packets import FIN, LINKTYPE_ETHERNET, RST, SYN, PacketRecord, parse_frame
+
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+BPF_RET_K = 0x06
+# Ethernet + IPv6 + TCP with options: enough for every header we parse
+HEADER_SNAPLEN = 14 + 40 + 60
+RECV_BUFFER = 1 << 16
+SOCKET_RCVBUF = 64 * 1024 * 1024
+# Knuth's multiplicative hash constant; mixes the endpoint sum before sampling
+SAMPLE_MULTIPLIER = 0x9E3779B1
+
+
+@dataclass
+class CapturePolicy:
+    """What to capture and how much of it to lift into Python.
+
+    ``ports`` restricts capture to port numbers or ranges (``"443"``,
+    ``"8000-8100"``); with ``control_elsewhere`` SYN/FIN/RST packets on other
+    ports are still captured so those connections are counted. ``bpf``
+    replaces the generated expression entirely; ports and sampling are then
+    applied in Python instead. ``snaplen`` truncates packets
+    in the kernel (0 keeps whole packets). ``payload_budget`` is the number
+    of payload bytes per flow that are inspected; later packets only update
+    counters. ``sample_rate`` keeps 1 in N connections, chosen by a symmetric
+    hash of addresses and ports that the kernel filter computes for IPv4.
+    """
+
+    bpf: Optional[str] = None
+    ports: List[str] = field(default_factory=list)
+    control_elsewhere: bool = False
+    snaplen: int = 0
+    payload_budget: int = 0
+    sample_rate: int = 1
+
+    def __post_init__(self) -> None:
+        self._ranges = [_port_range(spec) for spec in self.ports]
+
+    def capture_filter(self) -> str:
+        if self.bpf:
+            return self.bpf
+        clauses = ["tcp"]
+        if self._ranges:
+            ports = " or ".join(
+                f"port {lo}" if lo == hi else f"portrange {lo}-{hi}" for lo, hi in self._ranges
+            )
+            if self.control_elsewhere:
+                ports += " or tcp[tcpflags] & (tcp-syn|tcp-fin|tcp-rst) != 0"
+            clauses.append(f"({ports})")
+        if self.sample_rate > 1:
+            # the sum of both addresses and ports is the same in both directions
+            endpoints = "ip[12:4] + ip[16:4] + tcp[0:2] + tcp[2:2]"
+            clauses.append(
+                f"(ip6 or ((({endpoints}) * {SAMPLE_MULTIPLIER:#x}) >> 16) % {self.sample_rate} = 0)"
+            )
+        return " and ".join(clauses)
+
+    def matches(self, rec: PacketRecord) -> bool:
+        """Apply ports and sampling in Python, e.g. to replayed captures."""
+        if self._ranges and not any(
+            lo <= rec.sport <= hi or lo <= rec.dport <= hi for lo, hi in self._ranges
+        ):
+            if not (self.control_elsewhere and rec.flags & (SYN | FIN | RST)):
+                return False
+        if self.sample_rate > 1:
+            return sample_key(rec) % self.sample_rate == 0
+        return True
+
+    def select(self, records: List[PacketRecord], kernel_filtered: bool = False) -> List[PacketRecord]:
+        """Drop the records of ``records`` outside the policy.
+
+        After the kernel filter only IPv6 packets still need sampling, since
+        the BPF expression can only hash IPv4 headers. A custom ``bpf``
+        carries neither ports nor sampling, so then every record is checked.
+        """
+        if kernel_filtered and not self.bpf:
+            if self.sample_rate <= 1:
+                return records
+            return [rec for rec in records if ":" not in rec.src or self.matches(rec)]
+        if not self._ranges and self.sample_rate <= 1:
+            return records
+        return [rec for rec in records if self.matches(rec)]
+
+
+def _port_range(spec: str):
+    lo, _, hi = spec.partition("-")
+    return int(lo), int(hi or lo)
+
+
+def _addr_sum(addr: str) -> int:
+    if ":" in addr:
+        packed = socket.inet_pton(socket.AF_INET6, addr)
+        return sum(struct.unpack("!4I", packed))
+    return struct.unpack("!I", socket.inet_aton(addr))[0]
+
+
+def sample_key(rec: PacketRecord) -> int:
+    """Direction-independent hash matching the kernel sampling expression."""
+    total = _addr_sum(rec.src) + _addr_sum(rec.dst) + rec.sport + rec.dport
+    return ((total * SAMPLE_MULTIPLIER) & 0xFFFFFFFF) >> 16
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+
+def attach_filter(sock: socket.socket, expression: str, iface: str, snaplen: int) -> None:
+    """Compile ``expression`` with libpcap and attach it with snap length ``snaplen``."""
+    from scapy.arch.common import compile_filter
+
+    prog = compile_filter(expression, iface)
+    if snaplen:
+        for i in range(prog.bf_len):
+            insn = prog.bf_insns[i]
+            if insn.code == BPF_RET_K and insn.k:
+                insn.k = snaplen
+    fprog = _SockFprog(prog.bf_len, ctypes.addressof(prog.bf_insns.contents))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
+
+
+def set_promiscuous(sock: socket.socket, iface: str) -> None:
+    """Receive frames for every MAC on ``iface``, e.g. from a mirror port.
+
+    The membership belongs to the socket, so the interface leaves promiscuous
+    mode again once the socket is closed.
+    """
+    mreq = struct.pack("iHH8s", socket.if_nametoindex(iface), PACKET_MR_PROMISC, 0, b"")
+    sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+
+
+def live_batches(
+    iface: str,
+    policy: CapturePolicy,
+    batch_size: int = 1024,
+    flush_interval: float = 0.1,
+    on_stats: Optional[Callable[[int, int], None]] = None,
+    promisc: Optional[bool] = None,
+) -> Iterator[List[PacketRecord]]:
+    """Yield header-parsed records from ``iface`` in batches.
+
+    A batch is also yielded after ``flush_interval`` seconds so quiet links
+    are not delayed. ``on_stats(packets, drops)`` receives the kernel's
+    counts since the previous call, including packets lost to a full buffer.
+    The interface is put in promiscuous mode unless ``promisc`` is false;
+    by default scapy's ``conf.sniff_promisc`` decides, as it does for
+    ``sniff()``.
+    """
+    if promisc is None:
+        from scapy.config import conf
+
+        promisc = conf.sniff_promisc
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+        sock.bind((iface, 0))
+        if promisc:
+            set_promiscuous(sock, iface)
+        attach_filter(sock, policy.capture_filter(), iface, policy.snaplen)
+        sock.settimeout(flush_interval)
+        buf = bytearray(RECV_BUFFER)
+        view = memoryview(buf)
+        recvfrom_into = sock.recvfrom_into
+        # loopback delivers every packet twice, once as outgoing
+        skip_outgoing = iface == "lo"
+        snaplen = min(policy.snaplen or RECV_BUFFER, RECV_BUFFER)
+        batch: List[PacketRecord] = []
+        deadline = time.monotonic() + flush_interval
+        while True:
+            try:
+                # MSG_TRUNC returns the length on the wire, not the captured length
+                wirelen, addr = recvfrom_into(buf, 0, socket.MSG_TRUNC)
+            except socket.timeout:
+                wirelen = 0
+            else:
+                if skip_outgoing and addr[2] == socket.PACKET_OUTGOING:
+                    wirelen = 0
+            if wirelen:
+                caplen = min(wirelen, snaplen)
+                rec = parse_frame(bytes(view[:caplen]), time.time(), wirelen, LINKTYPE_ETHERNET)
+                if rec is not None:
+                    batch.append(rec)
+            if batch and (len(batch) >= batch_size or time.monotonic() >= deadline):
+                yield batch
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + flush_interval
+                if on_stats is not None:
+                    # reading the statistics also resets them
+                    on_stats(*struct.unpack("II", sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8)))
+    finally:
+        sock.close()
+
+
+def has_packet_socket() -> bool:
+    """Whether live capture can use the kernel-filtered ``AF_PACKET`` path."""
+    if not hasattr(socket, "AF_PACKET"):
+        return False
+    try:
+        from scapy.arch.common import compile_filter
+        from scapy.error import Scapy_Exception
+    except ImportError:
+        return False
+    try:
+        compile_filter("tcp")
+    except (ImportError, OSError, Scapy_Exception):
+        # e.g. no libpcap or no CAP_NET_RAW; fall back to sniff()
+        return False
+    return True
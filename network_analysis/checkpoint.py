@@ -0,0 +1,96 @@
+"""Compact binary checkpoints of the flow table and baseline.
+
+Layout (little endian)::
+
+    header   magic "TECK", version u16, created f64, flow count u32
+    flows    count x (key, state length u32, state bytes)
+    baseline length u32, NumPy ``.npz`` bytes (empty when untrained)
+
+A key is the address family byte (4 or 6), both packed addresses and both
+ports. State bytes come from ``FlowState.pack``. Files are written to a
+temporary name and renamed, so a crash mid-write leaves the previous
+checkpoint in place.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import struct
+from typing import Iterable, List, Tuple
+
+MAGIC = b"TECK"
+VERSION = 1
+HEADER = struct.Struct("<4sHdI")
+LENGTH = struct.Struct("<I")
+PORTS = struct.Struct("<HH")
+
+KeyTuple = Tuple[str, int, str, int]
+
+
+def pack_key(src: str, sport: int, dst: str, dport: int) -> bytes:
+    if ":" in src:
+        family, size = socket.AF_INET6, 6
+    else:
+        family, size = socket.AF_INET, 4
+    return (
+        bytes((size,))
+        + socket.inet_pton(family, src)
+        + socket.inet_pton(family, dst)
+        + PORTS.pack(sport, dport)
+    )
+
+
+def unpack_key(data: bytes, offset: int) -> Tuple[KeyTuple, int]:
+    size = data[offset]
+    family, width = (socket.AF_INET6, 16) if size == 6 else (socket.AF_INET, 4)
+    offset += 1
+    src = socket.inet_ntop(family, data[offset:offset + width])
+    dst = socket.inet_ntop(family, data[offset + width:offset + 2 * width])
+    offset += 2 * width
+    sport, dport = PORTS.unpack_from(data, offset)
+    return (src, sport, dst, dport), offset + PORTS.size
+
+
+def write_checkpoint(
+    path: str, flows: Iterable[Tuple[KeyTuple, bytes]], baseline: bytes, created: float
+) -> int:
+    """Stream ``flows`` and the ``baseline`` blob to ``path``; return the flow count."""
+    tmp = f"{path}.tmp"
+    count = 0
+    with open(tmp, "wb", buffering=1 << 20) as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, created, 0))
+        for key, state in flows:
+            fh.write(pack_key(*key))
+            fh.write(LENGTH.pack(len(state)))
+            fh.write(state)
+            count += 1
+        fh.write(LENGTH.pack(len(baseline)))
+        fh.write(baseline)
+        fh.seek(0)
+        fh.write(HEADER.pack(MAGIC, VERSION, created, count))
+    os.replace(tmp, path)
+    return count
+
+
+def read_checkpoint(path: str) -> Tuple[float, List[Tuple[KeyTuple, memoryview]], bytes]:
+    """Return ``(created, [(key, state bytes), ...], baseline bytes)``."""
+    with open(path, "rb") as fh:
+        data = fh.read()
+    magic, version, created, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not a flow checkpoint")
+    if version != VERSION:
+        raise ValueError(f"{path}: unsupported checkpoint version {version}")
+    view = memoryview(data)
+    offset = HEADER.size
+    flows = []
+    for _ in range(count):
+        key, offset = unpack_key(data, offset)
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        flows.append((key, view[offset:offset + length]))
+        offset += length
+    (length,) = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    return created, flows, bytes(view[offset:offset + length])
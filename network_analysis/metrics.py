@@ -0,0 +1,197 @@
+"""In-process counters, gauges and histograms with a Prometheus text endpoint.
+
+Metrics are plain Python objects updated under a tiny per-metric lock, so the
+cost of an update is a lock round trip and an addition. Per-packet paths
+count whole batches at once rather than single packets. ``Registry.serve``
+exposes everything in the Prometheus text format on ``/metrics``.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# seconds; covers sub-millisecond Python work up to slow model requests
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float]
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic count; ``fn`` reads the value from elsewhere instead."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, labels: Labels = (), fn: Optional[Callable[[], float]] = None) -> None:
+        super().__init__(name, labels)
+        self.fn = fn
+        self._value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self.fn() if self.fn is not None else self._value
+
+    def samples(self) -> Iterator[Sample]:
+        yield self.name, self.labels, self.value
+
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. a queue depth read through ``fn``."""
+
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative ``buckets``."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, labels: Labels = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield f"{self.name}_bucket", self.labels + (("le", _format_value(bound)),), cumulative
+        yield f"{self.name}_sum", self.labels, total
+        yield f"{self.name}_count", self.labels, cumulative
+
+
+class Registry:
+    """Named metrics; asking twice for the same name and labels returns the same object."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[Tuple[str, Labels], Metric] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def _get(self, cls, name: str, help: str, labels: Dict[str, str], **kwargs) -> Metric:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, key[1], **kwargs)
+                self._help.setdefault(name, help)
+            elif type(metric) is not cls:
+                raise ValueError(f"metric {name} already registered as {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str = "", fn: Optional[Callable[[], float]] = None, **labels) -> Counter:
+        return self._get(Counter, name, help, labels, fn=fn)
+
+    def gauge(self, name: str, help: str = "", fn: Optional[Callable[[], float]] = None, **labels) -> Gauge:
+        return self._get(Gauge, name, help, labels, fn=fn)
+
+    def histogram(
+        self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS, **labels
+    ) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines: List[str] = []
+        current = None
+        for metric in metrics:
+            if metric.name != current:
+                current = metric.name
+                lines.append(f"# HELP {metric.name} {self._help.get(metric.name, '')}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Expose ``/metrics`` on ``addr:port`` from a daemon thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        self._server = server
+        return server
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
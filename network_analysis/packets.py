@@ -0,0 +1,137 @@
+"""Lightweight packet records and header-only frame parsing."""
+
+from __future__ import annotations
+
+import socket
+import struct
+import zlib
+from typing import NamedTuple, Optional
+
+# libpcap link-layer header types handled by the header-only parser
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_TCP = 6
+
+# TCP flag bits
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+PSH = 0x08
+ACK = 0x10
+URG = 0x20
+
+_unpack_ethertype = struct.Struct("!H").unpack_from
+_unpack_ports_seq = struct.Struct("!HHI").unpack_from
+
+
+class PacketRecord(NamedTuple):
+    """Header fields of a single TCP segment needed for flow tracking."""
+
+    ts: float
+    src: str
+    dst: str
+    sport: int
+    dport: int
+    flags: int
+    length: int
+    seq: int = 0
+    payload: bytes = b""
+    # payload length on the wire; larger than len(payload) for truncated captures
+    payload_len: int = 0
+
+
+def parse_frame(
+    data: bytes, ts: float, wirelen: int, linktype: int = LINKTYPE_ETHERNET
+) -> Optional[PacketRecord]:
+    """Parse a captured frame without building scapy layers.
+
+    Returns ``None`` for anything that is not TCP over IPv4/IPv6 or that was
+    truncated before the end of the TCP header.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        off = 12
+        ethertype = _unpack_ethertype(data, off)[0]
+        while ethertype in ETHERTYPE_VLAN and len(data) >= off + 6:
+            off += 4
+            ethertype = _unpack_ethertype(data, off)[0]
+        off += 2
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not data:
+            return None
+        off = 0
+        ethertype = ETHERTYPE_IPV6 if data[0] >> 4 == 6 else ETHERTYPE_IPV4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        off = 16
+        ethertype = _unpack_ethertype(data, 14)[0]
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(data) < 20:
+            return None
+        off = 20
+        ethertype = _unpack_ethertype(data, 0)[0]
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        if len(data) < 5:
+            return None
+        off = 4
+        ethertype = ETHERTYPE_IPV6 if data[4] >> 4 == 6 else ETHERTYPE_IPV4
+    else:
+        return None
+
+    if ethertype == ETHERTYPE_IPV4:
+        if len(data) < off + 20:
+            return None
+        ihl = (data[off] & 0x0F) * 4
+        if data[off + 9] != IPPROTO_TCP:
+            return None
+        # skip non-first fragments, they carry no TCP header
+        if (data[off + 6] & 0x1F) or data[off + 7]:
+            return None
+        total_len = (data[off + 2] << 8) | data[off + 3]
+        src = socket.inet_ntoa(data[off + 12:off + 16])
+        dst = socket.inet_ntoa(data[off + 16:off + 20])
+        end = off + total_len if total_len else len(data)
+        off += ihl
+    elif ethertype == ETHERTYPE_IPV6:
+        if len(data) < off + 40 or data[off + 6] != IPPROTO_TCP:
+            return None
+        payload_len = (data[off + 4] << 8) | data[off + 5]
+        src = socket.inet_ntop(socket.AF_INET6, data[off + 8:off + 24])
+        dst = socket.inet_ntop(socket.AF_INET6, data[off + 24:off + 40])
+        off += 40
+        end = off + payload_len
+    else:
+        return None
+
+    if len(data) < off + 20:
+        return None
+    sport, dport, seq = _unpack_ports_seq(data, off)
+    data_off = (data[off + 12] >> 4) * 4
+    flags = data[off + 13]
+    start = off + data_off
+    payload_len = end - start if end > start else 0
+    end = min(end, len(data))
+    payload = data[start:end] if end > start else b""
+    return PacketRecord(ts, src, dst, sport, dport, flags, wirelen, seq, payload, payload_len)
+
+
+def flow_hash(src: str, sport: int, dst: str, dport: int) -> int:
+    """Stable hash of a TCP connection that is the same in both directions."""
+    a = f"{src}:{sport}"
+    b = f"{dst}:{dport}"
+    if a > b:
+        a, b = b, a
+    return zlib.crc32(f"{a}|{b}".encode())
@@ -0,0 +1,145 @@
+"""Streaming pcap/pcapng reader for offline replay through the flow table."""
+
+from __future__ import annotations
+
+import gzip
+import os
+import struct
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from packets import PacketRecord, parse_frame
+
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+
+PCAP_SUFFIXES = (".pcap", ".pcapng", ".cap", ".pcap.gz", ".pcapng.gz")
+READ_BUFFER = 1 << 20
+
+
+def _open(path: str) -> BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb", buffering=READ_BUFFER)
+
+
+def _read_pcap(fh: BinaryIO, magic: bytes) -> Iterator[Tuple[bytes, float, int, int]]:
+    if struct.unpack("<I", magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = "<"
+    elif struct.unpack(">I", magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = ">"
+    else:
+        raise ValueError("not a pcap or pcapng file")
+    nanos = struct.unpack(endian + "I", magic)[0] == PCAP_MAGIC_NS
+    header = fh.read(20)
+    if len(header) < 20:
+        return
+    linktype = struct.unpack(endian + "HHiIII", header)[5] & 0x0FFFFFFF
+    divisor = 1e9 if nanos else 1e6
+    rec_hdr = struct.Struct(endian + "IIII")
+    read = fh.read
+    while True:
+        hdr = read(16)
+        if len(hdr) < 16:
+            return
+        sec, frac, caplen, wirelen = rec_hdr.unpack(hdr)
+        data = read(caplen)
+        if len(data) < caplen:
+            return
+        yield data, sec + frac / divisor, wirelen, linktype
+
+
+def _read_pcapng(fh: BinaryIO, first: bytes) -> Iterator[Tuple[bytes, float, int, int]]:
+    endian = "<"
+    interfaces: List[Tuple[int, float]] = []
+    block = first
+    while True:
+        if len(block) < 8:
+            return
+        if struct.unpack("<I", block[:4])[0] == PCAPNG_SHB:
+            bom = fh.read(4)
+            endian = "<" if bom == b"\x4d\x3c\x2b\x1a" else ">"
+            total = struct.unpack(endian + "I", block[4:8])[0]
+            fh.read(total - 12)
+            interfaces = []
+        else:
+            btype, total = struct.unpack(endian + "II", block)
+            body = fh.read(total - 8)
+            if len(body) < total - 8:
+                return
+            if btype == PCAPNG_IDB:
+                interfaces.append((struct.unpack(endian + "H", body[:2])[0], _if_tsresol(body, endian)))
+            elif btype == PCAPNG_EPB:
+                iface, ts_hi, ts_lo, caplen, wirelen = struct.unpack(endian + "IIIII", body[:20])
+                linktype, resol = interfaces[iface]
+                yield body[20:20 + caplen], ((ts_hi << 32) | ts_lo) * resol, wirelen, linktype
+            elif btype == PCAPNG_SPB and interfaces:
+                wirelen = struct.unpack(endian + "I", body[:4])[0]
+                linktype, _ = interfaces[0]
+                yield body[4:4 + wirelen], 0.0, wirelen, linktype
+        block = fh.read(8)
+
+
+def _if_tsresol(body: bytes, endian: str) -> float:
+    """Return seconds per timestamp unit from an IDB's ``if_tsresol`` option."""
+    off = 8
+    while off + 4 <= len(body) - 4:
+        code, length = struct.unpack(endian + "HH", body[off:off + 4])
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            val = body[off + 4]
+            return 2.0 ** -(val & 0x7F) if val & 0x80 else 10.0 ** -val
+        off += 4 + ((length + 3) & ~3)
+    return 1e-6
+
+
+def read_frames(path: str) -> Iterator[Tuple[bytes, float, int, int]]:
+    """Yield ``(frame, timestamp, wirelen, linktype)`` for every frame in ``path``."""
+    with _open(path) as fh:
+        magic = fh.read(4)
+        if len(magic) < 4:
+            return
+        if struct.unpack("<I", magic)[0] == PCAPNG_SHB:
+            yield from _read_pcapng(fh, magic + fh.read(4))
+        else:
+            yield from _read_pcap(fh, magic)
+
+
+def iter_records(path: str) -> Iterator[PacketRecord]:
+    """Yield header-only :class:`PacketRecord` objects for TCP frames in ``path``."""
+    for data, ts, wirelen, linktype in read_frames(path):
+        rec = parse_frame(data, ts, wirelen, linktype)
+        if rec is not None:
+            yield rec
+
+
+def iter_batches(paths: Iterable[str], batch_size: int = 4096) -> Iterator[List[PacketRecord]]:
+    """Stream records from ``paths`` in lists of up to ``batch_size``."""
+    batch: List[PacketRecord] = []
+    append = batch.append
+    for path in paths:
+        for rec in iter_records(path):
+            append(rec)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+                append = batch.append
+    if batch:
+        yield batch
+
+
+def collect_paths(pcaps: Optional[List[str]] = None, pcap_dir: Optional[str] = None) -> List[str]:
+    """Resolve ``--pcap`` files and ``--pcap-dir`` into a sorted replay order."""
+    paths = list(pcaps or [])
+    if pcap_dir:
+        found = []
+        for root, _, files in os.walk(pcap_dir):
+            found.extend(
+                os.path.join(root, name) for name in files if name.endswith(PCAP_SUFFIXES)
+            )
+        paths.extend(sorted(found))
+    return paths
@@ -0,0 +1,329 @@
+"""Per-direction TCP stream reassembly with bounded buffers.
+
+Segments are placed by sequence number: retransmitted bytes are dropped,
+out-of-order segments wait in a small per-direction buffer, and contiguous
+bytes are delivered in order to the flow's payload sample and to any
+registered :class:`StreamInspector`. Memory is bounded three ways: each
+direction stops after ``depth`` delivered bytes, holds at most
+``flow_buffer`` out-of-order bytes, and all flows together hold at most
+``max_buffered`` bytes. When a segment cannot be buffered the hole before it
+is skipped and counted as a gap.
+
+A direction starts at its SYN's sequence number plus one. Streams picked up
+without a SYN hold their first ``ANCHOR_SEGMENTS`` segments and start at the
+lowest of them, so a reordered start is not mistaken for a retransmission.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from packets import SYN, PacketRecord
+
+SEQ_MASK = 0xFFFFFFFF
+SEQ_HALF = 1 << 31
+REASSEMBLY_DEPTH = 64 * 1024
+FLOW_BUFFER = 64 * 1024
+MAX_BUFFERED = 256 * 1024 * 1024
+# segments held before a stream seen without its SYN picks a starting point
+ANCHOR_SEGMENTS = 4
+
+
+def seq_offset(seq: int, base: int) -> int:
+    """Signed distance from ``base`` to ``seq`` in 32-bit sequence space."""
+    offset = (seq - base) & SEQ_MASK
+    return offset - (1 << 32) if offset >= SEQ_HALF else offset
+
+
+class StreamInspector:
+    """Receives the in-order bytes of both directions of every flow.
+
+    ``new_flow`` returns the per-flow context handed back to ``feed`` and
+    ``result``; ``result`` is stored under ``name`` in the flow report.
+    ``depth`` is how many bytes per direction the inspector wants (``None``
+    for all of them), so reassembly can stop early.
+    """
+
+    name = "inspector"
+    depth: Optional[int] = None
+
+    def new_flow(self) -> Any:
+        return None
+
+    def feed(self, ctx: Any, forward: bool, data: bytes) -> None:
+        raise NotImplementedError
+
+    def result(self, ctx: Any) -> Optional[Dict]:
+        return None
+
+
+class StreamReassembler:
+    """One direction of a TCP connection."""
+
+    __slots__ = ("next_seq", "pending", "pending_bytes", "delivered", "duplicate_bytes", "gap_bytes", "done")
+
+    def __init__(self) -> None:
+        self.next_seq: Optional[int] = None
+        self.pending: Dict[int, bytes] = {}
+        self.pending_bytes = 0
+        self.delivered = 0
+        self.duplicate_bytes = 0
+        self.gap_bytes = 0
+        self.done = False
+
+
+class FlowStreams:
+    """Both directions of a flow, ``sample`` receiving forward bytes."""
+
+    __slots__ = ("fwd", "bwd", "contexts", "sample")
+
+    def __init__(self, contexts: List[Any], sample: Callable[[bytes], None]) -> None:
+        self.fwd = StreamReassembler()
+        self.bwd = StreamReassembler()
+        self.contexts = contexts
+        self.sample = sample
+
+
+class Reassembly:
+    """Reassembly limits, global buffer accounting and the inspector chain.
+
+    Without inspectors only the forward direction is reassembled, since the
+    payload sample is all that consumes it. The engine caps ``depth`` at what
+    the payload sample and the inspectors ask for.
+    """
+
+    def __init__(
+        self,
+        depth: int = REASSEMBLY_DEPTH,
+        flow_buffer: int = FLOW_BUFFER,
+        max_buffered: int = MAX_BUFFERED,
+        inspectors: Optional[List[StreamInspector]] = None,
+    ) -> None:
+        self.depth = depth
+        self.flow_buffer = flow_buffer
+        self.max_buffered = max_buffered
+        self.inspectors = list(inspectors or [])
+        self.buffered = 0
+        self.duplicate_bytes = 0
+        self.gap_bytes = 0
+
+    def open(self, sample: Callable[[bytes], None]) -> FlowStreams:
+        return FlowStreams([inspector.new_flow() for inspector in self.inspectors], sample)
+
+    def add(self, streams: FlowStreams, rec: PacketRecord, forward: bool) -> None:
+        """Place ``rec``'s payload and deliver whatever became contiguous."""
+        if forward:
+            stream = streams.fwd
+        elif self.inspectors:
+            stream = streams.bwd
+        else:
+            return
+        if stream.done:
+            return
+        seq = rec.seq
+        payload = rec.payload
+        if stream.next_seq is None:
+            if rec.flags & SYN:
+                stream.next_seq = (seq + 1) & SEQ_MASK
+            elif len(payload) == rec.payload_len:
+                if self._hold(stream, seq, payload):
+                    self._release_held(streams, stream, forward)
+                return
+            else:
+                # a truncated segment cannot be held; start no later than it
+                stream.next_seq = seq
+                if stream.pending and seq_offset(self._lowest(stream), seq) < 0:
+                    stream.next_seq = self._lowest(stream)
+            if stream.pending:
+                self._release_held(streams, stream, forward)
+        if not rec.payload_len:
+            return
+        if rec.flags & SYN:
+            seq = (seq + 1) & SEQ_MASK
+        size = len(payload)
+        if seq == stream.next_seq and not stream.pending and size == rec.payload_len:
+            # in-order segment within the depth, the common case
+            stream.next_seq = (seq + size) & SEQ_MASK
+            if size < self.depth - stream.delivered:
+                stream.delivered += size
+                if forward:
+                    streams.sample(payload)
+                for inspector, ctx in zip(self.inspectors, streams.contexts):
+                    inspector.feed(ctx, forward, payload)
+            else:
+                self._deliver(streams, stream, forward, (payload,))
+            return
+        chunks: List[bytes] = []
+        self._place(stream, seq, payload, rec.payload_len, chunks)
+        if chunks:
+            self._deliver(streams, stream, forward, chunks)
+
+    def close(self, streams: FlowStreams) -> Dict[str, Any]:
+        """Deliver what is still buffered, skipping holes, and collect inspector results."""
+        for forward, stream in ((True, streams.fwd), (False, streams.bwd)):
+            if stream.next_seq is None and stream.pending:
+                stream.next_seq = self._lowest(stream)
+            if stream.pending and not stream.done:
+                chunks: List[bytes] = []
+                self._skip_holes(stream, chunks)
+                self._deliver(streams, stream, forward, chunks)
+            self._release(stream)
+        results: Dict[str, Any] = {
+            "duplicate_bytes": streams.fwd.duplicate_bytes + streams.bwd.duplicate_bytes,
+            "gap_bytes": streams.fwd.gap_bytes + streams.bwd.gap_bytes,
+        }
+        for inspector, ctx in zip(self.inspectors, streams.contexts):
+            result = inspector.result(ctx)
+            if result is not None:
+                results[inspector.name] = result
+        return results
+
+    def _hold(self, stream: StreamReassembler, seq: int, data: bytes) -> bool:
+        """Buffer a segment of a stream without a starting point; ``True`` once one should be picked."""
+        length = len(data)
+        if not length:
+            return False
+        held = stream.pending.get(seq)
+        if held is not None:
+            if len(held) >= length:
+                stream.duplicate_bytes += length
+                self.duplicate_bytes += length
+                return False
+            self._pop(stream, seq)
+        stream.pending[seq] = data
+        stream.pending_bytes += length
+        self.buffered += length
+        return (
+            len(stream.pending) >= ANCHOR_SEGMENTS
+            or stream.pending_bytes >= self.flow_buffer
+            or self.buffered >= self.max_buffered
+        )
+
+    @staticmethod
+    def _lowest(stream: StreamReassembler) -> int:
+        base = next(iter(stream.pending))
+        return min(stream.pending, key=lambda s: seq_offset(s, base))
+
+    def _release_held(self, streams: FlowStreams, stream: StreamReassembler, forward: bool) -> None:
+        """Start a stream at its SYN or its lowest held segment and deliver what is contiguous."""
+        if stream.next_seq is None:
+            stream.next_seq = self._lowest(stream)
+        chunks: List[bytes] = []
+        self._drain(stream, chunks)
+        if chunks:
+            self._deliver(streams, stream, forward, chunks)
+
+    def _place(
+        self,
+        stream: StreamReassembler,
+        seq: int,
+        data: bytes,
+        length: int,
+        chunks: List[bytes],
+        drain: bool = True,
+    ) -> None:
+        if not length:
+            return
+        offset = seq_offset(seq, stream.next_seq)
+        if offset < 0:
+            behind = -offset
+            if behind >= length:
+                stream.duplicate_bytes += length
+                self.duplicate_bytes += length
+                return
+            stream.duplicate_bytes += behind
+            self.duplicate_bytes += behind
+            data = data[behind:]
+            length -= behind
+            offset = 0
+        if offset == 0:
+            self._accept(stream, data, length, chunks)
+            if drain and stream.pending:
+                self._drain(stream, chunks)
+            return
+        if len(data) < length:
+            # truncated by the snap length; only the in-order case can use it
+            return
+        if seq in stream.pending:
+            stream.duplicate_bytes += length
+            self.duplicate_bytes += length
+            return
+        if (
+            stream.pending_bytes + length > self.flow_buffer
+            or self.buffered + length > self.max_buffered
+        ):
+            self._skip_holes(stream, chunks)
+            offset = seq_offset(seq, stream.next_seq)
+            if offset <= 0:
+                self._place(stream, seq, data, length, chunks)
+                return
+            stream.gap_bytes += offset
+            self.gap_bytes += offset
+            self._accept(stream, data, length, chunks)
+            return
+        stream.pending[seq] = data
+        stream.pending_bytes += length
+        self.buffered += length
+
+    def _accept(self, stream: StreamReassembler, data: bytes, length: int, chunks: List[bytes]) -> None:
+        stream.next_seq = (stream.next_seq + length) & SEQ_MASK
+        if len(data) < length:
+            stream.gap_bytes += length - len(data)
+            self.gap_bytes += length - len(data)
+        if data:
+            chunks.append(data)
+
+    def _pop(self, stream: StreamReassembler, seq: int) -> bytes:
+        data = stream.pending.pop(seq)
+        stream.pending_bytes -= len(data)
+        self.buffered -= len(data)
+        return data
+
+    def _drain(self, stream: StreamReassembler, chunks: List[bytes]) -> None:
+        """Deliver buffered segments that are now contiguous."""
+        base = stream.next_seq
+        for seq in sorted(stream.pending, key=lambda s: seq_offset(s, base)):
+            if seq_offset(seq, stream.next_seq) > 0:
+                break
+            data = self._pop(stream, seq)
+            self._place(stream, seq, data, len(data), chunks, drain=False)
+
+    def _skip_holes(self, stream: StreamReassembler, chunks: List[bytes]) -> None:
+        """Deliver every buffered segment in order, counting the holes between them."""
+        base = stream.next_seq
+        for seq in sorted(stream.pending, key=lambda s: seq_offset(s, base)):
+            offset = seq_offset(seq, stream.next_seq)
+            if offset > 0:
+                stream.gap_bytes += offset
+                self.gap_bytes += offset
+                stream.next_seq = seq
+            data = self._pop(stream, seq)
+            self._place(stream, seq, data, len(data), chunks, drain=False)
+
+    def _deliver(
+        self,
+        streams: FlowStreams,
+        stream: StreamReassembler,
+        forward: bool,
+        chunks: Sequence[bytes],
+    ) -> None:
+        room = self.depth - stream.delivered
+        for data in chunks:
+            if room <= 0:
+                break
+            if len(data) > room:
+                data = data[:room]
+            room -= len(data)
+            stream.delivered += len(data)
+            if forward:
+                streams.sample(data)
+            for inspector, ctx in zip(self.inspectors, streams.contexts):
+                inspector.feed(ctx, forward, data)
+        if room <= 0:
+            stream.done = True
+            self._release(stream)
+
+    def _release(self, stream: StreamReassembler) -> None:
+        self.buffered -= stream.pending_bytes
+        stream.pending.clear()
+        stream.pending_bytes = 0
@@ -0,0 +1,333 @@
+"""Buffered output sinks for finalized flow reports.
+
+Reports are handed to a :class:`BufferedSink`, which collects them from any
+thread and writes them in batches from a background thread to one or more
+sinks: newline-delimited JSON on stdout or in rotating (optionally gzip
+compressed) files, or columnar Parquet files when ``pyarrow`` is installed.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Optional: pyarrow for columnar output
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+FLUSH_INTERVAL = 1.0
+MAX_PENDING = 100_000
+ROTATE_BYTES = 256 * 1024 * 1024
+ROTATE_SECONDS = 3600.0
+PARQUET_ROW_GROUP = 10_000
+SINK_KINDS = ("jsonl", "jsonl.gz", "parquet")
+# Parquet columns of every report, whether or not the first one carries them;
+# nested parts are JSON text
+REPORT_COLUMNS = (
+    ("src", "string"),
+    ("src_port", "int64"),
+    ("dst", "string"),
+    ("dst_port", "int64"),
+    ("proto", "string"),
+    ("end_reason", "string"),
+    ("baseline_deviation", "float64"),
+    ("threat_matches", "string"),
+    ("inspection", "string"),
+    ("ml_result", "string"),
+)
+# keys outside the file's schema end up here as a JSON object
+EXTRA_COLUMN = "extra"
+
+
+class ReportSink:
+    """Writes batches of report dicts; subclasses implement ``write_batch``."""
+
+    def write_batch(self, reports: List[Dict]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class StdoutSink(ReportSink):
+    def write_batch(self, reports: List[Dict]) -> None:
+        sys.stdout.write("".join(json.dumps(r) + "\n" for r in reports))
+        sys.stdout.flush()
+
+
+class RotatingFileSink(ReportSink):
+    """Base for sinks writing ``<prefix>-<timestamp>-<n><suffix>`` files in ``directory``."""
+
+    suffix = ""
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str = "flows",
+        rotate_bytes: int = ROTATE_BYTES,
+        rotate_seconds: float = ROTATE_SECONDS,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self._seq = 0
+        self._opened = 0.0
+        self._written = 0
+        self.path: Optional[str] = None
+
+    def _next_path(self) -> str:
+        self._seq += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.directory, f"{self.prefix}-{stamp}-{self._seq:04d}{self.suffix}")
+
+    def _due(self) -> bool:
+        return self.path is None or (
+            self._written >= self.rotate_bytes
+            or time.monotonic() - self._opened >= self.rotate_seconds
+        )
+
+    def _rotate(self) -> None:
+        self._finish()
+        self.path = self._next_path()
+        self._opened = time.monotonic()
+        self._written = 0
+        self._start(self.path)
+
+    def write_batch(self, reports: List[Dict]) -> None:
+        if self._due():
+            self._rotate()
+        self._written += self._write(reports)
+
+    def close(self) -> None:
+        self._finish()
+        self.path = None
+
+    def _start(self, path: str) -> None:
+        raise NotImplementedError
+
+    def _write(self, reports: List[Dict]) -> int:
+        raise NotImplementedError
+
+    def _finish(self) -> None:
+        raise NotImplementedError
+
+
+class JsonLinesSink(RotatingFileSink):
+    """Newline-delimited JSON files, gzip compressed when ``compress`` is set."""
+
+    def __init__(self, directory: str, compress: bool = False, **kwargs) -> None:
+        super().__init__(directory, **kwargs)
+        self.compress = compress
+        self.suffix = ".jsonl.gz" if compress else ".jsonl"
+        self._fh = None
+
+    def _start(self, path: str) -> None:
+        if self.compress:
+            self._fh = gzip.open(path, "wt", compresslevel=6, encoding="utf-8")
+        else:
+            self._fh = open(path, "w", buffering=1 << 20, encoding="utf-8")
+
+    def _write(self, reports: List[Dict]) -> int:
+        data = "".join(json.dumps(r) + "\n" for r in reports)
+        self._fh.write(data)
+        return len(data)
+
+    def _finish(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def flatten_report(report: Dict) -> Dict:
+    """One flat row per report: flow and feature fields become columns and
+    free-form parts (model verdicts, indicator hits) are kept as JSON text."""
+    row = {}
+    for key, value in report.items():
+        if key in ("flow", "features") and isinstance(value, dict):
+            prefix = "" if key == "flow" else "f_"
+            for name, item in value.items():
+                row[prefix + name] = item
+        elif isinstance(value, (dict, list)):
+            row[key] = json.dumps(value)
+        else:
+            row[key] = value
+    return row
+
+
+class ParquetSink(RotatingFileSink):
+    """Columnar batches in Parquet files, one row group per ``row_group`` reports.
+
+    The schema is :data:`REPORT_COLUMNS`, all nullable, plus the feature
+    columns of the first row group. A file's schema cannot change once
+    written, so keys that only appear later go into the ``extra`` column
+    instead of being dropped.
+    """
+
+    suffix = ".parquet"
+
+    def __init__(self, directory: str, row_group: int = PARQUET_ROW_GROUP, **kwargs) -> None:
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)")
+        super().__init__(directory, **kwargs)
+        self.row_group = row_group
+        self.schema = None
+        self._rows: List[Dict] = []
+        self._writer = None
+
+    def _start(self, path: str) -> None:
+        self._path = path
+
+    def _write(self, reports: List[Dict]) -> int:
+        self._rows.extend(flatten_report(r) for r in reports)
+        written = 0
+        while len(self._rows) >= self.row_group:
+            written += self._write_group(self._rows[:self.row_group])
+            del self._rows[:self.row_group]
+        return written
+
+    def _write_group(self, rows: List[Dict]) -> int:
+        if self.schema is None:
+            self.schema = self._schema(rows)
+        names = set(self.schema.names)
+        table = pa.Table.from_pylist([self._fit(row, names) for row in rows], schema=self.schema)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._path, self.schema, compression="zstd")
+        self._writer.write_table(table)
+        return table.nbytes
+
+    @staticmethod
+    def _schema(rows: List[Dict]) -> "pa.Schema":
+        fields = [pa.field(name, getattr(pa, kind)()) for name, kind in REPORT_COLUMNS]
+        known = {name for name, _ in REPORT_COLUMNS}
+        for row in rows:
+            for name in row:
+                if name not in known:
+                    known.add(name)
+                    kind = pa.array([r.get(name) for r in rows], from_pandas=True).type
+                    fields.append(pa.field(name, pa.string() if pa.types.is_null(kind) else kind))
+        fields.append(pa.field(EXTRA_COLUMN, pa.string()))
+        return pa.schema(fields)
+
+    @staticmethod
+    def _fit(row: Dict, names) -> Dict:
+        extra = {key: value for key, value in row.items() if key not in names}
+        if not extra:
+            return row
+        fitted = {key: value for key, value in row.items() if key in names}
+        fitted[EXTRA_COLUMN] = json.dumps(extra, default=str)
+        return fitted
+
+    def _finish(self) -> None:
+        if self._rows and self.path is not None:
+            self._write_group(self._rows)
+            self._rows = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class BufferedSink:
+    """Accept reports from any thread and flush them to ``sinks`` in batches.
+
+    A background thread writes whatever has accumulated every
+    ``flush_interval`` seconds or as soon as ``batch_size`` reports are
+    pending. Producers block once ``max_pending`` reports are waiting, so a
+    stalled disk slows capture down rather than exhausting memory. A sink
+    that raises loses that batch, counted in ``dropped``, and the writer
+    carries on with the next one.
+    """
+
+    def __init__(
+        self,
+        sinks: List[ReportSink],
+        flush_interval: float = FLUSH_INTERVAL,
+        batch_size: int = 1024,
+        max_pending: int = MAX_PENDING,
+    ) -> None:
+        self.sinks = sinks
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: List[Dict] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = [0] * len(sinks)
+        self._failing = [False] * len(sinks)
+        self._thread = threading.Thread(target=self._run, name="report-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, report: Dict) -> None:
+        with self._cond:
+            while len(self._pending) >= self.max_pending and not self._closed:
+                self._cond.wait()
+            self._pending.append(report)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                batch, self._pending = self._pending, []
+                closed = self._closed
+                self._cond.notify_all()
+            if batch:
+                for i, sink in enumerate(self.sinks):
+                    try:
+                        sink.write_batch(batch)
+                    except Exception as e:
+                        # report the first failure of a run, not every batch of a full disk
+                        if not self._failing[i]:
+                            print(f"report sink {type(sink).__name__} failed: {e!r}", file=sys.stderr)
+                        self._failing[i] = True
+                        self.dropped[i] += len(batch)
+                    else:
+                        self._failing[i] = False
+            if closed and not batch:
+                return
+
+    def close(self) -> None:
+        """Flush everything pending and close the underlying sinks."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+
+def open_sink(spec: str, rotate_bytes: int = ROTATE_BYTES, rotate_seconds: float = ROTATE_SECONDS) -> ReportSink:
+    """Build a sink from ``-`` (stdout) or ``<kind>:<directory>``."""
+    if spec == "-":
+        return StdoutSink()
+    kind, sep, directory = spec.partition(":")
+    if not sep or kind not in SINK_KINDS:
+        raise ValueError(f"invalid output {spec!r}; use '-' or one of {', '.join(SINK_KINDS)} with :<directory>")
+    rotation = dict(rotate_bytes=rotate_bytes, rotate_seconds=rotate_seconds)
+    if kind == "parquet":
+        return ParquetSink(directory, **rotation)
+    return JsonLinesSink(directory, compress=kind == "jsonl.gz", **rotation)
+
+
+def build_sink(
+    specs: Optional[List[str]] = None,
+    rotate_bytes: int = ROTATE_BYTES,
+    rotate_seconds: float = ROTATE_SECONDS,
+    flush_interval: float = FLUSH_INTERVAL,
+) -> BufferedSink:
+    sinks = [open_sink(spec, rotate_bytes, rotate_seconds) for spec in (specs or ["-"])]
+    return BufferedSink(sinks, flush_interval=flush_interval)
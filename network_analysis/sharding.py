@@ -0,0 +1,225 @@
+"""Multi-process flow processing sharded by a symmetric five-tuple hash.
+
+The capturing process only parses packets and routes them: every packet of a
+connection hashes to the same worker process, which owns a private
+``TrafficEngine`` flow table. Workers send finished reports to a single
+output process so the report stream stays one ordered-per-line writer.
+"""
+
+from __future__ import annotations
+
+import json
+import multiprocessing as mp
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+from capture_policy import CapturePolicy, has_packet_socket, live_batches
+from metrics import Registry
+from packets import PacketRecord, flow_hash
+from pcap_replay import iter_batches
+
+CHUNK_SIZE = 512
+INBOX_CHUNKS = 64
+FLUSH_INTERVAL = 0.1
+SHARD_DONE = "__shard_done__"
+
+# engine_factory(shard, emit) -> TrafficEngine
+EngineFactory = Callable[[int, Callable[[Dict], None]], object]
+
+
+def _worker(
+    shard: int,
+    engine_factory: EngineFactory,
+    inbox: mp.Queue,
+    outbox: mp.Queue,
+    live: bool,
+    sweep_interval: float,
+) -> None:
+    # the parent handles Ctrl-C and shuts workers down with a sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    engine = engine_factory(shard, outbox.put)
+    while True:
+        try:
+            batch = inbox.get(timeout=sweep_interval if live else None)
+        except queue.Empty:
+            engine.sweep(time.time())
+            engine.save_due()
+            continue
+        if batch is None:
+            break
+        engine.process_batch(batch)
+        if live:
+            engine.save_due()
+    if not live:
+        engine.flush()
+    engine.close()
+    outbox.put((SHARD_DONE, shard, dict(engine.scoring.stats)))
+
+
+def _output(outbox: mp.Queue, workers: int, sink_factory: Callable) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sink = sink_factory()
+    done = 0
+    totals: Counter = Counter()
+    while done < workers:
+        item = outbox.get()
+        if isinstance(item, tuple) and item[0] == SHARD_DONE:
+            done += 1
+            totals.update(item[2])
+            continue
+        sink.write(item)
+    sink.close()
+    print(json.dumps({"scoring": dict(totals)}), file=sys.stderr)
+
+
+class ShardedRunner:
+    """Route packets to ``workers`` processes by :func:`packets.flow_hash`.
+
+    ``sink_factory`` builds the report sink inside the output process.
+    Capture-side counters (policy filtering, kernel packets and drops) live
+    in this process's ``metrics`` registry, since workers never see them.
+    """
+
+    def __init__(
+        self,
+        engine_factory: EngineFactory,
+        workers: int,
+        sink_factory: Callable,
+        live: bool = False,
+        sweep_interval: float = 5.0,
+        chunk_size: int = CHUNK_SIZE,
+        metrics: Optional[Registry] = None,
+    ) -> None:
+        ctx = mp.get_context("fork")
+        self.workers = workers
+        self.live = live
+        self.chunk_size = chunk_size
+        self.inboxes = [ctx.Queue(maxsize=INBOX_CHUNKS) for _ in range(workers)]
+        self.outbox = ctx.Queue()
+        self._buffers: List[List[PacketRecord]] = [[] for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.metrics = m = metrics or Registry()
+        self._filtered = m.counter("traffic_packets_filtered_total", "Packets dropped by the capture policy")
+        self._kernel_packets = m.counter(
+            "capture_kernel_packets_total", "Packets that passed the kernel capture filter"
+        )
+        self._kernel_drops = m.counter(
+            "capture_kernel_drops_total", "Packets dropped by the kernel because the socket buffer was full"
+        )
+        self._procs = [
+            ctx.Process(
+                target=_worker,
+                args=(i, engine_factory, self.inboxes[i], self.outbox, live, sweep_interval),
+                name=f"flow-shard-{i}",
+            )
+            for i in range(workers)
+        ]
+        self._procs.append(
+            ctx.Process(
+                target=_output, args=(self.outbox, workers, sink_factory), name="flow-output"
+            )
+        )
+        for proc in self._procs:
+            proc.start()
+
+    def submit(self, rec: Optional[PacketRecord]) -> None:
+        if rec is None:
+            return
+        with self._lock:
+            buf = self._buffers[flow_hash(rec.src, rec.sport, rec.dst, rec.dport) % self.workers]
+            buf.append(rec)
+            if len(buf) >= self.chunk_size:
+                self._send_full()
+
+    def submit_batch(self, records: Iterable[PacketRecord]) -> None:
+        n = self.workers
+        with self._lock:
+            buffers = self._buffers
+            for rec in records:
+                buffers[flow_hash(rec.src, rec.sport, rec.dst, rec.dport) % n].append(rec)
+            self._send_full()
+
+    def flush(self) -> None:
+        """Send partially filled buffers, e.g. so quiet links are not delayed."""
+        with self._lock:
+            for shard, buf in enumerate(self._buffers):
+                if buf:
+                    self.inboxes[shard].put(buf)
+                    self._buffers[shard] = []
+
+    def _send_full(self) -> None:
+        for shard, buf in enumerate(self._buffers):
+            if len(buf) >= self.chunk_size:
+                self.inboxes[shard].put(buf)
+                self._buffers[shard] = []
+
+    def replay(
+        self, paths: List[str], batch_size: int = 4096, policy: Optional[CapturePolicy] = None
+    ) -> Dict:
+        policy = policy or CapturePolicy()
+        packets = 0
+        started = time.perf_counter()
+        for batch in iter_batches(paths, batch_size):
+            selected = policy.select(batch)
+            self._filtered.inc(len(batch) - len(selected))
+            self.submit_batch(selected)
+            packets += len(batch)
+        self.close()
+        elapsed = time.perf_counter() - started
+        return {
+            "files": len(paths),
+            "packets": packets,
+            "workers": self.workers,
+            "seconds": elapsed,
+            "packets_per_sec": packets / elapsed if elapsed else 0.0,
+        }
+
+    def capture(self, iface: str, policy: CapturePolicy, to_record: Callable) -> None:
+        flusher = threading.Thread(target=self._flush_loop, name="shard-flush", daemon=True)
+        flusher.start()
+        try:
+            if has_packet_socket():
+                for batch in live_batches(iface, policy, self.chunk_size, on_stats=self._kernel_stats):
+                    selected = policy.select(batch, kernel_filtered=True)
+                    self._filtered.inc(len(batch) - len(selected))
+                    self.submit_batch(selected)
+            else:
+                from scapy.all import sniff
+
+                def route(pkt) -> None:
+                    rec = to_record(pkt)
+                    if rec is None:
+                        return
+                    if not policy.matches(rec):
+                        self._filtered.inc()
+                        return
+                    self.submit(rec)
+
+                sniff(iface=iface, filter=policy.capture_filter(), prn=route, store=False)
+        finally:
+            self.close()
+
+    def _kernel_stats(self, packets: int, drops: int) -> None:
+        self._kernel_packets.inc(packets)
+        self._kernel_drops.inc(drops)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self.flush()
+
+    def close(self) -> None:
+        """Drain buffered packets, stop the workers and wait for the output."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self.flush()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for proc in self._procs:
+            proc.join()
@@ -0,0 +1,148 @@
+"""Multi-pattern payload signatures scanned over reassembled streams.
+
+All patterns are compiled once into an Aho-Corasick automaton with a full
+transition table, so every payload byte costs one table lookup no matter how
+many signatures are loaded. Scanning is incremental: each flow direction
+keeps its automaton state between chunks, so patterns split across segments
+still match.
+
+Signature files are CSV rows of ``name,pattern[,label]``. Patterns are
+literal text with Snort-style hex blocks, e.g. ``GET /|2e 2e|/``; the label
+defaults to ``malicious``, and flows matching only ``benign`` signatures
+count as known-good traffic.
+"""
+
+from __future__ import annotations
+
+import csv
+import re
+from array import array
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from reassembly import StreamInspector
+
+SCAN_DEPTH = 8192
+BENIGN = "benign"
+HEX_BLOCK_RE = re.compile(r"\|([0-9A-Fa-f\s]*)\|")
+
+
+class Signature(NamedTuple):
+    name: str
+    pattern: bytes
+    label: str = "malicious"
+
+
+def parse_pattern(text: str) -> bytes:
+    """Decode literal text with ``|hex bytes|`` blocks into bytes."""
+    out = bytearray()
+    pos = 0
+    for match in HEX_BLOCK_RE.finditer(text):
+        out += text[pos:match.start()].encode("latin-1")
+        out += bytes.fromhex(match.group(1))
+        pos = match.end()
+    out += text[pos:].encode("latin-1")
+    return bytes(out)
+
+
+def load_signatures(paths: Iterable[str]) -> List[Signature]:
+    signatures = []
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as fh:
+            for row in csv.reader(fh):
+                if len(row) < 2 or row[0].startswith("#"):
+                    continue
+                pattern = parse_pattern(row[1])
+                if pattern:
+                    label = row[2].strip().lower() if len(row) > 2 and row[2].strip() else "malicious"
+                    signatures.append(Signature(row[0].strip(), pattern, label))
+    return signatures
+
+
+class Automaton:
+    """Aho-Corasick automaton over bytes, compiled to a full transition table."""
+
+    def __init__(self, patterns: List[bytes]) -> None:
+        goto: List[Dict[int, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for byte in pattern:
+                nxt = goto[state].get(byte)
+                if nxt is None:
+                    nxt = goto[state][byte] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(index)
+
+        # breadth-first: each state's row starts as a copy of its fail state's row
+        fail = [0] * len(goto)
+        rows: List[Optional[array]] = [None] * len(goto)
+        rows[0] = array("I", bytes(4 * 256))
+        for byte, child in goto[0].items():
+            rows[0][byte] = child
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            row = array("I", rows[fail[state]])
+            for byte, child in goto[state].items():
+                fail[child] = rows[fail[state]][byte]
+                outputs[child] = outputs[child] + outputs[fail[child]]
+                row[byte] = child
+                pending.append(child)
+            rows[state] = row
+        self.rows = rows
+        self.outputs: List[Tuple[int, ...]] = [tuple(out) for out in outputs]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def scan(self, state: int, data: bytes, hits: set) -> int:
+        """Advance from ``state`` over ``data``, adding matched pattern indexes to ``hits``."""
+        rows = self.rows
+        outputs = self.outputs
+        for byte in data:
+            state = rows[state][byte]
+            if outputs[state]:
+                hits.update(outputs[state])
+        return state
+
+
+class SignatureInspector(StreamInspector):
+    """Tags flows with the signatures found in the first ``depth`` bytes of each direction."""
+
+    name = "signatures"
+
+    def __init__(self, signatures: List[Signature], depth: int = SCAN_DEPTH) -> None:
+        self.signatures = signatures
+        self.depth = depth
+        self.automaton = Automaton([sig.pattern for sig in signatures])
+
+    def new_flow(self) -> list:
+        # forward state, backward state, bytes scanned per direction, hits
+        return [0, 0, 0, 0, set()]
+
+    def feed(self, ctx: list, forward: bool, data: bytes) -> None:
+        if not self.signatures:
+            return
+        side = 0 if forward else 1
+        room = self.depth - ctx[2 + side]
+        if room <= 0:
+            return
+        if len(data) > room:
+            data = data[:room]
+        ctx[2 + side] += len(data)
+        ctx[side] = self.automaton.scan(ctx[side], data, ctx[4])
+
+    def result(self, ctx: list) -> Optional[List[Dict[str, str]]]:
+        if not ctx[4]:
+            return None
+        return [
+            {"name": self.signatures[i].name, "label": self.signatures[i].label}
+            for i in sorted(ctx[4])
+        ]
+
+
+def only_benign(matches: Optional[List[Dict[str, str]]]) -> bool:
+    return bool(matches) and all(m["label"] == BENIGN for m in matches)
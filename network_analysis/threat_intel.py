@@ -0,0 +1,321 @@
+"""Indexed threat-intelligence matching for finalized flows.
+
+Indicators are bulk-loaded from STIX 2.x bundles (JSON) and CSV/plain text
+files into purpose-built indexes: binary prefix tries for CIDR ranges and
+hashed dicts for exact IPs, domains and JA3 fingerprints.
+"""
+
+from __future__ import annotations
+
+import csv
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import socket
+import struct
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+STIX_VALUE_RE = re.compile(
+    r"(ipv4-addr|ipv6-addr|domain-name|x-ja3-hash|ja3)(?::value|:hash)?\s*=\s*'([^']+)'"
+)
+STIX_TYPES = {
+    "ipv4-addr": "ip",
+    "ipv6-addr": "ip",
+    "domain-name": "domain",
+    "x-ja3-hash": "ja3",
+    "ja3": "ja3",
+}
+CSV_TYPES = {
+    "ip": "ip",
+    "ipv4": "ip",
+    "ipv6": "ip",
+    "ip-dst": "ip",
+    "ip-src": "ip",
+    "cidr": "ip",
+    "domain": "domain",
+    "hostname": "domain",
+    "ja3": "ja3",
+    "ja3_md5": "ja3",
+}
+HEX32_RE = re.compile(r"^[0-9a-fA-F]{32}$")
+
+# TLS extensions whose values are excluded from JA3 (GREASE)
+GREASE = {0x0A0A + 0x1010 * i for i in range(16)}
+
+
+class PrefixTrie:
+    """Binary trie answering longest-prefix matches for one address family."""
+
+    def __init__(self, bits: int) -> None:
+        self.bits = bits
+        self.root: list = [None, None, None]
+        self.size = 0
+
+    def insert(self, network: int, prefixlen: int, label: str) -> None:
+        node = self.root
+        for i in range(self.bits - 1, self.bits - 1 - prefixlen, -1):
+            bit = (network >> i) & 1
+            child = node[bit]
+            if child is None:
+                child = node[bit] = [None, None, None]
+            node = child
+        if node[2] is None:
+            self.size += 1
+        node[2] = label
+
+    def lookup(self, address: int) -> Optional[str]:
+        node = self.root
+        found = node[2]
+        for i in range(self.bits - 1, -1, -1):
+            node = node[(address >> i) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                found = node[2]
+        return found
+
+
+class IndicatorIndex:
+    """Immutable set of indexes built from one load of the indicator files."""
+
+    def __init__(self) -> None:
+        self.ips: Dict[str, str] = {}
+        self.v4 = PrefixTrie(32)
+        self.v6 = PrefixTrie(128)
+        self.domains: Dict[str, str] = {}
+        self.ja3: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.ips) + self.v4.size + self.v6.size + len(self.domains) + len(self.ja3)
+
+    def add(self, kind: str, value: str, label: str) -> bool:
+        value = value.strip()
+        if not value:
+            return False
+        if kind == "ip":
+            addr, _, prefix = value.partition("/")
+            try:
+                if ":" in addr:
+                    family, packed = socket.AF_INET6, socket.inet_pton(socket.AF_INET6, addr)
+                else:
+                    family, packed = socket.AF_INET, socket.inet_aton(addr)
+                bits = len(packed) * 8
+                prefixlen = int(prefix) if prefix else bits
+            except (OSError, ValueError):
+                return False
+            if not 0 <= prefixlen <= bits:
+                return False
+            if prefixlen == bits:
+                self.ips[socket.inet_ntop(family, packed)] = label
+            else:
+                trie = self.v4 if bits == 32 else self.v6
+                trie.insert(int.from_bytes(packed, "big"), prefixlen, label)
+        elif kind == "domain":
+            self.domains[value.lower().rstrip(".")] = label
+        elif kind == "ja3":
+            self.ja3[value.lower()] = label
+        else:
+            return False
+        return True
+
+    def match_ip(self, ip: str) -> Optional[str]:
+        label = self.ips.get(ip)
+        if label is not None:
+            return label
+        try:
+            if ":" in ip:
+                return self.v6.lookup(int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big"))
+            return self.v4.lookup(struct.unpack("!I", socket.inet_aton(ip))[0])
+        except OSError:
+            return None
+
+    def match_domain(self, host: str) -> Optional[str]:
+        """Match ``host`` or any parent domain, e.g. ``a.evil.com`` -> ``evil.com``."""
+        host = host.lower().rstrip(".")
+        while host:
+            label = self.domains.get(host)
+            if label is not None:
+                return label
+            _, _, host = host.partition(".")
+        return None
+
+
+def _classify(value: str) -> Optional[str]:
+    """Guess the indicator type of a bare value from a plain list."""
+    try:
+        ipaddress.ip_network(value, strict=False)
+        return "ip"
+    except ValueError:
+        pass
+    if HEX32_RE.match(value):
+        return "ja3"
+    if "." in value and " " not in value:
+        return "domain"
+    return None
+
+
+def iter_stix(path: str) -> Iterator[Tuple[str, str]]:
+    with open(path, encoding="utf-8") as fh:
+        bundle = json.load(fh)
+    objects = bundle.get("objects", []) if isinstance(bundle, dict) else bundle
+    for obj in objects:
+        kind = obj.get("type")
+        if kind == "indicator":
+            for stix_type, value in STIX_VALUE_RE.findall(obj.get("pattern", "")):
+                yield STIX_TYPES[stix_type], value
+        elif kind in STIX_TYPES and "value" in obj:
+            yield STIX_TYPES[kind], obj["value"]
+
+
+def iter_csv(path: str) -> Iterator[Tuple[str, str]]:
+    """Yield indicators from ``type,value`` rows or a bare one-per-line list."""
+    with open(path, newline="", encoding="utf-8") as fh:
+        for row in csv.reader(fh):
+            if not row or row[0].startswith("#"):
+                continue
+            if len(row) >= 2 and row[0].strip().lower() in CSV_TYPES:
+                yield CSV_TYPES[row[0].strip().lower()], row[1]
+            elif len(row) >= 2 and row[1].strip().lower() in CSV_TYPES:
+                yield CSV_TYPES[row[1].strip().lower()], row[0]
+            else:
+                kind = _classify(row[0].strip())
+                if kind:
+                    yield kind, row[0]
+
+
+def load_index(paths: Iterable[str]) -> IndicatorIndex:
+    index = IndicatorIndex()
+    for path in paths:
+        label = os.path.basename(path)
+        reader = iter_stix if path.endswith(".json") else iter_csv
+        for kind, value in reader(path):
+            index.add(kind, value, label)
+    return index
+
+
+def parse_client_hello(payload: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Return ``(sni, ja3)`` from a TLS ClientHello at the start of ``payload``."""
+    try:
+        if len(payload) < 43 or payload[0] != 0x16 or payload[5] != 0x01:
+            return None, None
+        off = 9
+        version = struct.unpack_from("!H", payload, off)[0]
+        off += 2 + 32
+        off += 1 + payload[off]
+        (cs_len,) = struct.unpack_from("!H", payload, off)
+        off += 2
+        ciphers = [
+            c for c in struct.unpack_from(f"!{cs_len // 2}H", payload, off) if c not in GREASE
+        ]
+        off += cs_len
+        off += 1 + payload[off]
+        sni = None
+        extensions: List[int] = []
+        curves: List[int] = []
+        formats: List[int] = []
+        if off + 2 <= len(payload):
+            (ext_total,) = struct.unpack_from("!H", payload, off)
+            off += 2
+            end = min(off + ext_total, len(payload))
+            while off + 4 <= end:
+                ext_type, ext_len = struct.unpack_from("!HH", payload, off)
+                body = payload[off + 4:off + 4 + ext_len]
+                off += 4 + ext_len
+                if ext_type in GREASE:
+                    continue
+                extensions.append(ext_type)
+                if ext_type == 0 and len(body) > 5:
+                    name_len = struct.unpack_from("!H", body, 3)[0]
+                    sni = body[5:5 + name_len].decode("ascii", "ignore")
+                elif ext_type == 10 and len(body) >= 2:
+                    count = struct.unpack_from("!H", body, 0)[0] // 2
+                    curves = [
+                        c for c in struct.unpack_from(f"!{count}H", body, 2) if c not in GREASE
+                    ]
+                elif ext_type == 11 and body:
+                    formats = list(body[1:1 + body[0]])
+    except (struct.error, IndexError):
+        return None, None
+    ja3 = ",".join(
+        [
+            str(version),
+            "-".join(map(str, ciphers)),
+            "-".join(map(str, extensions)),
+            "-".join(map(str, curves)),
+            "-".join(map(str, formats)),
+        ]
+    )
+    return sni, hashlib.md5(ja3.encode()).hexdigest()
+
+
+def parse_http_host(payload: bytes) -> Optional[str]:
+    end = payload.find(b"\r\n\r\n")
+    head = payload[:end if end >= 0 else len(payload)]
+    for line in head.split(b"\r\n")[1:]:
+        if line[:5].lower() == b"host:":
+            return line[5:].strip().split(b":")[0].decode("ascii", "ignore") or None
+    return None
+
+
+class ThreatIntelCorrelator:
+    """Match flows against indicator files, reloading them when they change."""
+
+    def __init__(self, paths: Optional[List[str]] = None, reload_interval: float = 60.0) -> None:
+        self.paths = list(paths or [])
+        self.reload_interval = reload_interval
+        self.index = IndicatorIndex()
+        self._mtimes: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        if self.paths:
+            self.reload()
+
+    def reload(self) -> int:
+        """Rebuild the indexes from disk and swap them in atomically."""
+        mtimes = {path: os.path.getmtime(path) for path in self.paths if os.path.exists(path)}
+        index = load_index(mtimes)
+        self.index = index
+        self._mtimes = mtimes
+        return len(index)
+
+    def start(self) -> None:
+        if self.paths and self.reload_interval > 0 and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="intel-reload", daemon=True)
+            self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.reload_interval):
+            current = {p: os.path.getmtime(p) for p in self.paths if os.path.exists(p)}
+            if current != self._mtimes:
+                try:
+                    self.reload()
+                except (OSError, ValueError):
+                    # keep serving the previous index if a file is mid-write
+                    continue
+
+    def check(self, src: str, dst: str, payload: bytes = b"") -> List[Dict[str, str]]:
+        """Return indicator hits for a flow's endpoints and leading payload."""
+        index = self.index
+        matches = []
+        for field, ip in (("src", src), ("dst", dst)):
+            label = index.match_ip(ip)
+            if label is not None:
+                matches.append({"field": field, "value": ip, "source": label})
+        if payload and (index.domains or index.ja3):
+            sni, ja3 = parse_client_hello(payload)
+            host = sni or parse_http_host(payload)
+            if host:
+                label = index.match_domain(host)
+                if label is not None:
+                    matches.append({"field": "host", "value": host, "source": label})
+            if ja3:
+                label = index.ja3.get(ja3)
+                if label is not None:
+                    matches.append({"field": "ja3", "value": ja3, "source": label})
+        return matches
@@ -3,19 +3,68 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import heapq
+import io
+import itertools
 import json
+import os
+import queue
+import struct
+import sys
+import threading
 import time
+from array import array
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Dict, Iterable, List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 import requests
 from scapy.all import IP, TCP, Raw, sniff
 
+from capture_policy import HEADER_SNAPLEN, CapturePolicy, has_packet_socket, live_batches
+from checkpoint import read_checkpoint, write_checkpoint
+from metrics import Registry
+from packets import ACK, FIN, PSH, RST, SYN, URG, PacketRecord
+from pcap_replay import collect_paths, iter_batches
+from reassembly import FLOW_BUFFER, MAX_BUFFERED, REASSEMBLY_DEPTH, FlowStreams, Reassembly, StreamInspector
+from report_sinks import ROTATE_BYTES, ROTATE_SECONDS, build_sink
+from sharding import ShardedRunner
+from signatures import SCAN_DEPTH, SignatureInspector, load_signatures
+from threat_intel import ThreatIntelCorrelator
+from triage import CACHE_SIZE, CACHE_TTL, SKIP_REASONS, TRIAGE_WARMUP, TokenBucket, Triage, VerdictCache
+
+PAYLOAD_SAMPLE_BYTES = 4096
+MAX_PACKET_SAMPLES = 256
+IDLE_TIMEOUT = 120.0
+ACTIVE_TIMEOUT = 1800.0
+MAX_FLOWS = 500_000
+SWEEP_INTERVAL = 5.0
+ML_WORKERS = 2
+ML_BATCH_SIZE = 16
+ML_BATCH_WAIT = 0.5
+ML_QUEUE_SIZE = 10_000
+ML_SAMPLE_EVERY = 10
+QUEUE_POLICIES = ("block", "drop", "sample")
+BASELINE_METRICS = ("zscore", "mahalanobis")
+# flows folded into the covariance before its inverse is recomputed
+BASELINE_REFRESH = 256
+BASELINE_SAVE_INTERVAL = 300.0
+INTEL_RELOAD_INTERVAL = 60.0
+CHECKPOINT_INTERVAL = 60.0
+# flows serialized per hold of the engine lock while checkpointing
+CHECKPOINT_CHUNK = 2048
+FLAG_NAMES = ("fin", "syn", "rst", "psh", "ack", "urg")
+END_REASONS = ("fin", "rst", "idle_timeout", "active_timeout", "evicted", "flush")
+SIZE_PERCENTILES = (25, 50, 75, 90)
+# start/last seen, six counters, FIN mask, flag counts, payload length, samples
+FLOW_STATE_STRUCT = struct.Struct(f"<2d6QB{len(FLAG_NAMES)}I2I")
+
 
 @dataclass(frozen=True)
 class FlowKey:
-    """Five-tuple identifying a TCP flow."""
+    """Five-tuple identifying a TCP flow, oriented from its first packet's sender."""
 
     src: str
     src_port: int
@@ -24,120 +73,1050 @@ class FlowKey:
     proto: str = "TCP"
 
 
-@dataclass
+@dataclass(slots=True)
 class FlowState:
-    packets: List
-    bytes: int = 0
+    """Fixed-size running summary of a bidirectional flow.
+
+    The forward direction is the one of the flow's first packet (the client,
+    unless capture started mid-connection). Counters cover every packet;
+    timestamps, sizes and directions are kept for the first ``max_samples``
+    packets and payload for the first ``payload_capacity`` reassembled forward
+    bytes, so memory per flow does not grow with the flow's length.
+    """
+
     start_time: float = 0.0
     last_seen: float = 0.0
-    payload: bytes = field(default_factory=bytes)
+    packet_count: int = 0
+    bytes: int = 0
+    payload_bytes: int = 0
+    fwd_packets: int = 0
+    fwd_bytes: int = 0
+    fwd_payload_bytes: int = 0
+    fin_mask: int = 0
+    flag_counts: array = field(default_factory=lambda: array("I", bytes(4 * len(FLAG_NAMES))))
+    payload_len: int = 0
+    payload: bytearray = field(default_factory=bytearray)
+    timestamps: array = field(default_factory=lambda: array("d"))
+    sizes: array = field(default_factory=lambda: array("I"))
+    directions: array = field(default_factory=lambda: array("b"))
+    streams: Optional[FlowStreams] = None
+
+    def add(
+        self,
+        rec: PacketRecord,
+        forward: bool = True,
+        max_samples: int = MAX_PACKET_SAMPLES,
+    ) -> None:
+        self.packet_count += 1
+        self.bytes += rec.length
+        self.last_seen = rec.ts
+        size = rec.payload_len
+        self.payload_bytes += size
+        if forward:
+            self.fwd_packets += 1
+            self.fwd_bytes += rec.length
+            self.fwd_payload_bytes += size
+        flags = rec.flags
+        if flags:
+            counts = self.flag_counts
+            if flags & FIN:
+                counts[0] += 1
+                self.fin_mask |= 1 if forward else 2
+            if flags & SYN:
+                counts[1] += 1
+            if flags & RST:
+                counts[2] += 1
+            if flags & PSH:
+                counts[3] += 1
+            if flags & ACK:
+                counts[4] += 1
+            if flags & URG:
+                counts[5] += 1
+        if len(self.sizes) < max_samples:
+            self.timestamps.append(rec.ts)
+            self.sizes.append(rec.length)
+            self.directions.append(forward)
+
+    def append_payload(self, data: bytes, capacity: int = PAYLOAD_SAMPLE_BYTES) -> None:
+        """Keep in-order forward bytes until ``capacity`` is reached."""
+        room = capacity - self.payload_len
+        if room > 0:
+            if not self.payload:
+                self.payload = bytearray(capacity)
+            chunk = min(room, len(data))
+            self.payload[self.payload_len:self.payload_len + chunk] = data[:chunk]
+            self.payload_len += chunk
+
+    def count(self, rec: PacketRecord, forward: bool = True) -> None:
+        """Update only the counters, for flows past their payload budget."""
+        self.packet_count += 1
+        self.bytes += rec.length
+        self.last_seen = rec.ts
+        self.payload_bytes += rec.payload_len
+        if forward:
+            self.fwd_packets += 1
+            self.fwd_bytes += rec.length
+            self.fwd_payload_bytes += rec.payload_len
+        flags = rec.flags
+        if flags & FIN:
+            self.flag_counts[0] += 1
+            self.fin_mask |= 1 if forward else 2
+        if flags & RST:
+            self.flag_counts[2] += 1
+
+    @property
+    def payload_sample(self) -> bytes:
+        return bytes(self.payload[:self.payload_len])
+
+    def pack(self) -> bytes:
+        """Serialize for a checkpoint; see :meth:`unpack`."""
+        samples = len(self.sizes)
+        return b"".join(
+            (
+                FLOW_STATE_STRUCT.pack(
+                    self.start_time,
+                    self.last_seen,
+                    self.packet_count,
+                    self.bytes,
+                    self.payload_bytes,
+                    self.fwd_packets,
+                    self.fwd_bytes,
+                    self.fwd_payload_bytes,
+                    self.fin_mask,
+                    *self.flag_counts,
+                    self.payload_len,
+                    samples,
+                ),
+                self.payload[:self.payload_len],
+                self.timestamps[:samples].tobytes(),
+                self.sizes.tobytes(),
+                self.directions[:samples].tobytes(),
+            )
+        )
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "FlowState":
+        fields = FLOW_STATE_STRUCT.unpack_from(data, 0)
+        nflags = len(FLAG_NAMES)
+        payload_len, samples = fields[9 + nflags:]
+        offset = FLOW_STATE_STRUCT.size
+        state = cls(*fields[:9], array("I", fields[9:9 + nflags]), payload_len)
+        state.payload = bytearray(data[offset:offset + payload_len])
+        offset += payload_len
+        state.timestamps.frombytes(data[offset:offset + 8 * samples])
+        offset += 8 * samples
+        state.sizes.frombytes(data[offset:offset + 4 * samples])
+        offset += 4 * samples
+        state.directions.frombytes(data[offset:offset + samples])
+        return state
+
+
+Expired = Tuple[FlowKey, FlowState, str]
+
+
+class FlowTable:
+    """Open flows ordered by last activity, with idle/active expiry.
+
+    The dict is kept in least-recently-seen order, so idle flows are always at
+    the front and can be expired (or evicted when ``max_flows`` is exceeded)
+    without scanning the table. Active timeouts use a heap of start-time
+    deadlines whose stale entries are skipped lazily.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = IDLE_TIMEOUT,
+        active_timeout: float = ACTIVE_TIMEOUT,
+        max_flows: int = MAX_FLOWS,
+    ) -> None:
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self._flows: OrderedDict[FlowKey, FlowState] = OrderedDict()
+        self._deadlines: List[Tuple[float, int, FlowKey]] = []
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._flows)
+
+    def __contains__(self, key: FlowKey) -> bool:
+        return key in self._flows
+
+    def __iter__(self) -> Iterator[FlowKey]:
+        return iter(self._flows)
+
+    def get(self, key: FlowKey) -> Optional[FlowState]:
+        return self._flows.get(key)
+
+    def pop(self, key: FlowKey) -> Optional[FlowState]:
+        return self._flows.pop(key, None)
+
+    def insert(self, key: FlowKey, state: FlowState) -> None:
+        """Add a flow as most recently seen, e.g. when restoring a checkpoint."""
+        self._flows[key] = state
+        heapq.heappush(self._deadlines, (state.start_time + self.active_timeout, next(self._seq), key))
+
+    def touch(self, rec: PacketRecord) -> Optional[Tuple[FlowKey, FlowState, bool]]:
+        """Find (or create) the flow of ``rec`` in either direction.
+
+        Marks the flow most recently seen and returns ``(key, state, forward)``,
+        or ``None`` for a bare ACK that does not belong to an open flow (such as
+        the last ACK after both FINs), which would only create a one-packet flow.
+        """
+        flows = self._flows
+        key = FlowKey(rec.src, rec.sport, rec.dst, rec.dport)
+        state = flows.get(key)
+        if state is not None:
+            flows.move_to_end(key)
+            return key, state, True
+        reverse = FlowKey(rec.dst, rec.dport, rec.src, rec.sport)
+        state = flows.get(reverse)
+        if state is not None:
+            flows.move_to_end(reverse)
+            return reverse, state, False
+        if rec.flags == ACK and not rec.payload_len:
+            return None
+        # a SYN/ACK means the first packet we saw came from the server
+        forward = (rec.flags & (SYN | ACK)) != (SYN | ACK)
+        if not forward:
+            key = reverse
+        state = flows[key] = FlowState(start_time=rec.ts, last_seen=rec.ts)
+        heapq.heappush(self._deadlines, (rec.ts + self.active_timeout, next(self._seq), key))
+        return key, state, forward
+
+    def evict_overflow(self) -> List[Expired]:
+        """Drop least recently seen flows until the table is within ``max_flows``."""
+        evicted = []
+        while len(self._flows) > self.max_flows:
+            key, state = self._flows.popitem(last=False)
+            evicted.append((key, state, "evicted"))
+        return evicted
+
+    def expire(self, now: float) -> List[Expired]:
+        """Remove and return every flow past its idle or active timeout."""
+        expired = []
+        flows = self._flows
+        idle_cutoff = now - self.idle_timeout
+        while flows:
+            key, state = next(iter(flows.items()))
+            if state.last_seen > idle_cutoff:
+                break
+            del flows[key]
+            expired.append((key, state, "idle_timeout"))
+
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, _, key = heapq.heappop(deadlines)
+            state = flows.get(key)
+            # the key may since have been finalized and reused by a newer flow
+            if state is not None and state.start_time + self.active_timeout <= deadline:
+                del flows[key]
+                expired.append((key, state, "active_timeout"))
+        if len(deadlines) > 2 * len(flows) + 1024:
+            self._compact_deadlines()
+        return expired
+
+    def _compact_deadlines(self) -> None:
+        self._deadlines = [
+            (state.start_time + self.active_timeout, next(self._seq), key)
+            for key, state in self._flows.items()
+        ]
+        heapq.heapify(self._deadlines)
 
 
 class MachineLearningAnalyzer:
     """Client for Ollama-hosted models."""
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, metrics: Optional[Registry] = None):
         self.url = url.rstrip("/")
+        self._local = threading.local()
+        metrics = metrics or Registry()
+        self._latency = metrics.histogram("ollama_request_seconds", "Ollama request latency")
+        self._errors = metrics.counter("ollama_request_errors_total", "Failed Ollama requests")
 
-    def analyze(self, features: Dict) -> Dict:
-        payload = {"model": "transformer-seq", "prompt": json.dumps(features)}
+    @property
+    def session(self) -> requests.Session:
+        # one keep-alive session per worker thread
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _post(self, payload: Dict, timeout: float) -> Dict:
+        start = time.perf_counter()
         try:
-            resp = requests.post(self.url, json=payload, timeout=5)
+            resp = self.session.post(self.url, json=payload, timeout=timeout)
             resp.raise_for_status()
             return resp.json()
-        except requests.RequestException:
+        except (requests.RequestException, ValueError):
+            self._errors.inc()
+            raise
+        finally:
+            self._latency.observe(time.perf_counter() - start)
+
+    def analyze(self, features: Dict) -> Dict:
+        payload = {"model": "transformer-seq", "prompt": json.dumps(features)}
+        try:
+            return self._post(payload, timeout=5)
+        except (requests.RequestException, ValueError):
             return {"error": "Ollama request failed"}
 
+    def analyze_batch(self, batch: List[Dict]) -> List[Dict]:
+        """Score several flows with one model request.
+
+        The model is asked for a JSON array with one verdict per flow. If the
+        answer cannot be split that way, every flow gets the raw response.
+        """
+        if len(batch) == 1:
+            return [self.analyze(batch[0])]
+        prompt = (
+            "Classify each of the following network flows. Reply with a JSON array "
+            "containing exactly one verdict object per flow, in the same order.\n"
+            + json.dumps(batch)
+        )
+        payload = {"model": "transformer-seq", "prompt": prompt, "format": "json", "stream": False}
+        try:
+            result = self._post(payload, timeout=5 + len(batch))
+        except (requests.RequestException, ValueError):
+            return [{"error": "Ollama request failed"}] * len(batch)
+        try:
+            verdicts = json.loads(result.get("response", ""))
+        except (TypeError, ValueError):
+            verdicts = None
+        if isinstance(verdicts, dict) and len(verdicts) == 1:
+            verdicts = next(iter(verdicts.values()))
+        if isinstance(verdicts, list) and len(verdicts) == len(batch):
+            return [v if isinstance(v, dict) else {"response": v} for v in verdicts]
+        return [result] * len(batch)
+
+
+class ScoringPipeline:
+    """Bounded queue of finalized flow reports scored by a pool of workers.
+
+    ``submit`` never waits on the model: when the queue is full the report is
+    either emitted unscored (``drop``), admitted 1-in-``sample_every`` once the
+    queue is half full (``sample``), or the caller blocks (``block``) to apply
+    backpressure to capture. Workers gather up to ``batch_size`` reports per
+    model request and hand each scored report to ``emit``. With a ``cache``,
+    reports resembling a recently scored flow reuse its verdict; with a
+    ``budget``, reports beyond the allowed model rate are emitted unscored.
+    """
+
+    def __init__(
+        self,
+        analyzer: MachineLearningAnalyzer,
+        emit: Callable[[Dict], None],
+        workers: int = ML_WORKERS,
+        batch_size: int = ML_BATCH_SIZE,
+        batch_wait: float = ML_BATCH_WAIT,
+        max_queue: int = ML_QUEUE_SIZE,
+        policy: str = "drop",
+        sample_every: int = ML_SAMPLE_EVERY,
+        budget: Optional[TokenBucket] = None,
+        cache: Optional[VerdictCache] = None,
+    ) -> None:
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"unknown queue policy: {policy}")
+        self.analyzer = analyzer
+        self.emit = emit
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+        self.budget = budget
+        self.cache = cache
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.stats = {
+            "submitted": 0,
+            "scored": 0,
+            "dropped": 0,
+            "sampled_out": 0,
+            "skipped": 0,
+            "cached": 0,
+            "over_budget": 0,
+        }
+        self._stats_lock = threading.Lock()
+        self._stop = object()
+        self._seen = 0
+        self._workers = [
+            threading.Thread(target=self._run, name=f"ml-scorer-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, report: Dict) -> None:
+        self._count("submitted")
+        if self.cache is not None:
+            verdict = self.cache.get(report["features"])
+            if verdict is not None:
+                self._count("cached")
+                report["ml_result"] = dict(verdict, cached=True)
+                self.emit(report)
+                return
+        if self.budget is not None and not self.budget.take():
+            self._count("over_budget")
+            report["ml_result"] = {"skipped": "over_budget"}
+            self.emit(report)
+            return
+        if self.policy == "block":
+            self.queue.put(report)
+            return
+        if self.policy == "sample" and self.queue.qsize() * 2 >= self.queue.maxsize:
+            with self._stats_lock:
+                self._seen += 1
+                sampled_out = self._seen % self.sample_every != 0
+                if sampled_out:
+                    self.stats["sampled_out"] += 1
+            if sampled_out:
+                report["ml_result"] = {"skipped": "sampled_out"}
+                self.emit(report)
+                return
+        try:
+            self.queue.put_nowait(report)
+        except queue.Full:
+            self._count("dropped")
+            report["ml_result"] = {"skipped": "queue_full"}
+            self.emit(report)
+
+    def skip(self, report: Dict, reason: str) -> None:
+        """Emit ``report`` without a model verdict, e.g. when a signature already decided it."""
+        self._count("skipped")
+        report["ml_result"] = {"skipped": reason}
+        self.emit(report)
+
+    def close(self) -> None:
+        """Score everything still queued, then stop the workers."""
+        for _ in self._workers:
+            self.queue.put(self._stop)
+        for worker in self._workers:
+            worker.join()
+
+    def _count(self, key: str) -> None:
+        # submit and skip run on both the capture and the flow-sweeper threads
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _run(self) -> None:
+        get = self.queue.get
+        while True:
+            item = get()
+            if item is self._stop:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._stop:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._score(batch)
+            if stopping:
+                return
+
+    def _score(self, batch: List[Dict]) -> None:
+        results = self.analyzer.analyze_batch([report["features"] for report in batch])
+        for report, result in zip(batch, results):
+            report["ml_result"] = result
+            if self.cache is not None:
+                self.cache.put(report["features"], result)
+            self.emit(report)
+        with self._stats_lock:
+            self.stats["scored"] += len(batch)
+
 
 class BaselineModel:
-    """Simple statistical baseline of flow features."""
+    """Streaming statistical baseline of flow features.
 
-    def __init__(self):
-        self.samples: List[np.ndarray] = []
+    Keeps a running mean and variance (Welford) in constant memory. With a
+    ``half_life`` (in flows) older flows are exponentially down-weighted so the
+    baseline follows drifting traffic like a soft sliding window. Deviation is
+    the norm of the per-feature z-scores, or the Mahalanobis distance, which
+    additionally tracks the covariance matrix. Its pseudo-inverse is only
+    recomputed after ``refresh`` updates (and on every update during the
+    first ``refresh`` flows), so scores use a covariance at most ``refresh``
+    flows old.
+    """
+
+    def __init__(
+        self,
+        metric: str = "zscore",
+        half_life: Optional[float] = None,
+        min_samples: int = 2,
+        metrics: Optional[Registry] = None,
+        refresh: int = BASELINE_REFRESH,
+    ) -> None:
+        if metric not in BASELINE_METRICS:
+            raise ValueError(f"unknown baseline metric: {metric}")
+        self.metric = metric
+        self.half_life = half_life
+        self.decay = 1.0 - 0.5 ** (1.0 / half_life) if half_life else 0.0
+        self.min_samples = min_samples
+        self.count = 0
+        self.weight = 0.0
+        self.mean: Optional[np.ndarray] = None
+        self.m2: Optional[np.ndarray] = None
+        self.cov: Optional[np.ndarray] = None
+        self._inv_cov: Optional[np.ndarray] = None
+        self.refresh = max(1, refresh)
+        self._stale = 0
+        self._lock = threading.Lock()
+        self._score_time = (metrics or Registry()).histogram(
+            "baseline_score_seconds", "Time to score a flow against the baseline"
+        )
 
     def update(self, vector: Iterable[float]) -> None:
-        self.samples.append(np.fromiter(vector, dtype=float))
+        with self._lock:
+            self._update(np.fromiter(vector, dtype=float))
 
     def score(self, vector: Iterable[float]) -> float:
-        if not self.samples:
+        with self._score_time.time(), self._lock:
+            return self._score(np.fromiter(vector, dtype=float))
+
+    def observe(self, vector: Iterable[float]) -> float:
+        """Score ``vector`` against the baseline, then fold it in."""
+        x = np.fromiter(vector, dtype=float)
+        with self._lock:
+            start = time.perf_counter()
+            deviation = self._score(x)
+            self._score_time.observe(time.perf_counter() - start)
+            self._update(x)
+        return deviation
+
+    def _update(self, x: np.ndarray) -> None:
+        if self.mean is None or self.mean.shape != x.shape:
+            self._reset(x.shape[0])
+        keep = 1.0 - self.decay
+        self.count += 1
+        self.weight = self.weight * keep + 1.0
+        delta = x - self.mean
+        self.mean += delta / self.weight
+        delta_after = x - self.mean
+        self.m2 = self.m2 * keep + delta * delta_after
+        if self.cov is not None:
+            self.cov = self.cov * keep + np.outer(delta, delta_after)
+            self._stale += 1
+            if self._stale >= self.refresh or self.count <= self.refresh:
+                self._inv_cov = None
+
+    def _score(self, x: np.ndarray) -> float:
+        if self.count < self.min_samples or self.mean is None or self.mean.shape != x.shape:
             return 0.0
-        mat = np.vstack(self.samples)
-        mean = mat.mean(axis=0)
-        return float(np.linalg.norm(np.fromiter(vector, dtype=float) - mean))
+        diff = x - self.mean
+        if self.metric == "mahalanobis":
+            if self._inv_cov is None:
+                self._inv_cov = np.linalg.pinv(self.cov / self.weight)
+                self._stale = 0
+            return float(np.sqrt(max(diff @ self._inv_cov @ diff, 0.0)))
+        std = np.sqrt(self.m2 / self.weight)
+        return float(np.linalg.norm(diff / np.maximum(std, 1e-9)))
+
+    def _reset(self, dim: int) -> None:
+        self.count = 0
+        self.weight = 0.0
+        self.mean = np.zeros(dim)
+        self.m2 = np.zeros(dim)
+        self.cov = np.zeros((dim, dim)) if self.metric == "mahalanobis" else None
+        self._inv_cov = None
+        self._stale = 0
+
+    def save(self, path: str) -> None:
+        """Atomically write the baseline state to ``path`` (NumPy ``.npz``)."""
+        data = self.dumps()
+        if not data:
+            return
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> None:
+        """Restore state written by :meth:`save`."""
+        with open(path, "rb") as fh:
+            self.loads(fh.read())
 
+    def dumps(self) -> bytes:
+        """The state as ``.npz`` bytes, or ``b""`` before the first update."""
+        with self._lock:
+            if self.mean is None:
+                return b""
+            arrays = {
+                "count": np.array(self.count),
+                "weight": np.array(self.weight),
+                "mean": self.mean.copy(),
+                "m2": self.m2.copy(),
+            }
+            if self.cov is not None:
+                arrays["cov"] = self.cov.copy()
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        return buf.getvalue()
 
-class ThreatIntelCorrelator:
-    """Placeholder for STIX/TAXII threat intelligence lookups."""
+    def loads(self, blob: bytes) -> None:
+        with np.load(io.BytesIO(blob)) as data, self._lock:
+            self._reset(data["mean"].shape[0])
+            self.count = int(data["count"])
+            self.weight = float(data["weight"])
+            self.mean = data["mean"].astype(float)
+            self.m2 = data["m2"].astype(float)
+            if self.cov is not None:
+                if "cov" in data:
+                    self.cov = data["cov"].astype(float)
+                else:
+                    # variance-only file: start from a diagonal covariance
+                    self.cov = np.diag(self.m2)
 
-    def __init__(self):
-        self.indicators = set()
 
-    def check(self, flow: FlowState) -> List[str]:
-        matches = []
-        for ip in [pkt[IP].src for pkt in flow.packets if IP in pkt]:
-            if ip in self.indicators:
-                matches.append(ip)
-        return matches
+def record_from_scapy(pkt) -> Optional[PacketRecord]:
+    """Convert a live scapy packet into a :class:`PacketRecord`."""
+    if not (IP in pkt and TCP in pkt):
+        return None
+    ip = pkt[IP]
+    tcp = pkt[TCP]
+    load = bytes(pkt[Raw].load) if Raw in pkt else b""
+    return PacketRecord(
+        float(pkt.time),
+        ip.src,
+        ip.dst,
+        tcp.sport,
+        tcp.dport,
+        int(tcp.flags),
+        len(pkt),
+        tcp.seq,
+        load,
+        len(load),
+    )
 
 
 class TrafficEngine:
-    def __init__(self, iface: str, ollama_url: str) -> None:
+    def __init__(
+        self,
+        iface: str,
+        ollama_url: str,
+        payload_capacity: int = PAYLOAD_SAMPLE_BYTES,
+        max_samples: int = MAX_PACKET_SAMPLES,
+        idle_timeout: float = IDLE_TIMEOUT,
+        active_timeout: float = ACTIVE_TIMEOUT,
+        max_flows: int = MAX_FLOWS,
+        sweep_interval: float = SWEEP_INTERVAL,
+        ml_workers: int = ML_WORKERS,
+        ml_batch_size: int = ML_BATCH_SIZE,
+        ml_queue_size: int = ML_QUEUE_SIZE,
+        ml_policy: str = "drop",
+        ml_sample_every: int = ML_SAMPLE_EVERY,
+        baseline_metric: str = "zscore",
+        baseline_half_life: Optional[float] = None,
+        baseline_refresh: int = BASELINE_REFRESH,
+        baseline_file: Optional[str] = None,
+        baseline_save_interval: float = BASELINE_SAVE_INTERVAL,
+        intel_paths: Optional[List[str]] = None,
+        intel_reload_interval: float = INTEL_RELOAD_INTERVAL,
+        reassembly_depth: int = REASSEMBLY_DEPTH,
+        reassembly_buffer: int = FLOW_BUFFER,
+        reassembly_memory: int = MAX_BUFFERED,
+        inspectors: Optional[List[StreamInspector]] = None,
+        signature_paths: Optional[List[str]] = None,
+        signature_depth: int = SCAN_DEPTH,
+        triage_threshold: Optional[float] = None,
+        triage_warmup: int = TRIAGE_WARMUP,
+        model_rate: float = 0.0,
+        verdict_cache_size: int = 0,
+        verdict_cache_ttl: float = CACHE_TTL,
+        checkpoint_file: Optional[str] = None,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL,
+        policy: Optional[CapturePolicy] = None,
+        metrics: Optional[Registry] = None,
+        emit: Optional[Callable[[Dict], None]] = None,
+    ) -> None:
         self.iface = iface
-        self.capture_filter = "tcp"
-        self.flows: Dict[FlowKey, FlowState] = {}
-        self.ml = MachineLearningAnalyzer(ollama_url)
-        self.baseline = BaselineModel()
-        self.threatintel = ThreatIntelCorrelator()
+        self.metrics = metrics = metrics or Registry()
+        self.policy = policy or CapturePolicy()
+        self.capture_filter = self.policy.capture_filter()
+        self.payload_budget = self.policy.payload_budget
+        self.sink = None
+        if emit is None:
+            self.sink = build_sink()
+            emit = self.sink.write
+        self.emit = emit
+        self.flows = FlowTable(idle_timeout, active_timeout, max_flows)
+        self.lock = threading.Lock()
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._stop = threading.Event()
+        self.ml = MachineLearningAnalyzer(ollama_url, metrics)
+        self.triage = Triage(triage_threshold, triage_warmup)
+        self.scoring = ScoringPipeline(
+            self.ml,
+            self.emit,
+            workers=ml_workers,
+            batch_size=ml_batch_size,
+            max_queue=ml_queue_size,
+            policy=ml_policy,
+            sample_every=ml_sample_every,
+            budget=TokenBucket(model_rate) if model_rate > 0 else None,
+            cache=VerdictCache(verdict_cache_size, verdict_cache_ttl) if verdict_cache_size > 0 else None,
+        )
+        self.baseline = BaselineModel(
+            baseline_metric, baseline_half_life, metrics=metrics, refresh=baseline_refresh
+        )
+        self.baseline_file = baseline_file
+        self.baseline_save_interval = baseline_save_interval
+        if baseline_file and os.path.exists(baseline_file):
+            self.baseline.load(baseline_file)
+        self.threatintel = ThreatIntelCorrelator(intel_paths, intel_reload_interval)
+        self.threatintel.start()
+        self.payload_capacity = payload_capacity
+        self.max_samples = max_samples
+        inspectors = list(inspectors or [])
+        if signature_paths:
+            inspectors.append(SignatureInspector(load_signatures(signature_paths), signature_depth))
+        wanted = [payload_capacity] + [inspector.depth for inspector in inspectors]
+        if None not in wanted:
+            # nothing consumes reassembled bytes beyond this
+            reassembly_depth = min(reassembly_depth, max(wanted))
+        self.reassembly = Reassembly(reassembly_depth, reassembly_buffer, reassembly_memory, inspectors)
+        self._register_metrics()
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self._next_baseline_save = time.monotonic() + baseline_save_interval
+        self._next_checkpoint = time.monotonic() + checkpoint_interval
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            self.restore(checkpoint_file)
 
-    def start(self) -> None:
-        sniff(
-            iface=self.iface,
-            filter=self.capture_filter,
-            prn=self._process_packet,
-            store=False,
+    def _register_metrics(self) -> None:
+        m = self.metrics
+        self._packets = m.counter("traffic_packets_total", "Packets processed by the flow table")
+        self._filtered = m.counter("traffic_packets_filtered_total", "Packets dropped by the capture policy")
+        self._untracked = m.counter(
+            "traffic_packets_untracked_total", "Bare ACKs that did not belong to an open flow"
+        )
+        self._kernel_packets = m.counter(
+            "capture_kernel_packets_total", "Packets that passed the kernel capture filter"
+        )
+        self._kernel_drops = m.counter(
+            "capture_kernel_drops_total", "Packets dropped by the kernel because the socket buffer was full"
         )
+        self._finalized = {
+            reason: m.counter("traffic_flows_finalized_total", "Flows finalized, by end reason", reason=reason)
+            for reason in END_REASONS
+        }
+        self._finalize_time = m.histogram(
+            "traffic_finalize_seconds", "Time to finalize a flow: features, baseline and threat intel"
+        )
+        self._feature_time = m.histogram("traffic_feature_extraction_seconds", "Time to extract flow features")
+        self._checkpoint_time = m.histogram("checkpoint_seconds", "Time to write a checkpoint")
+        self._checkpoint_pause = m.histogram(
+            "checkpoint_pause_seconds", "Longest hold of the flow table lock per checkpoint"
+        )
+        m.gauge("traffic_active_flows", "Flows currently tracked", fn=lambda: len(self.flows))
+        m.gauge(
+            "reassembly_buffered_bytes",
+            "Out-of-order bytes waiting for reassembly",
+            fn=lambda: self.reassembly.buffered,
+        )
+        m.counter(
+            "reassembly_duplicate_bytes_total",
+            "Retransmitted payload bytes dropped by reassembly",
+            fn=lambda: self.reassembly.duplicate_bytes,
+        )
+        m.counter(
+            "reassembly_gap_bytes_total",
+            "Payload bytes never seen or skipped by reassembly",
+            fn=lambda: self.reassembly.gap_bytes,
+        )
+        m.gauge("ml_queue_depth", "Finalized flows waiting for scoring", fn=self.scoring.queue.qsize)
+        for outcome in self.scoring.stats:
+            m.counter(
+                "ml_reports_total",
+                "Finalized flow reports by scoring outcome",
+                fn=functools.partial(self.scoring.stats.get, outcome),
+                outcome=outcome,
+            )
+        self._skipped = {
+            reason: m.counter("ml_skipped_total", "Flows kept from the model by triage, by reason", reason=reason)
+            for reason in SKIP_REASONS
+        }
+
+    def _kernel_stats(self, packets: int, drops: int) -> None:
+        self._kernel_packets.inc(packets)
+        self._kernel_drops.inc(drops)
+
+    def start(self) -> None:
+        sweeper = threading.Thread(target=self._sweep_loop, name="flow-sweeper", daemon=True)
+        sweeper.start()
+        try:
+            if has_packet_socket():
+                batches = live_batches(self.iface, self.policy, on_stats=self._kernel_stats)
+                for batch in batches:
+                    selected = self.policy.select(batch, kernel_filtered=True)
+                    self._filtered.inc(len(batch) - len(selected))
+                    self.process_batch(selected)
+            else:
+                sniff(
+                    iface=self.iface,
+                    filter=self.capture_filter,
+                    prn=self._process_packet,
+                    store=False,
+                )
+        finally:
+            self._stop.set()
+
+    def _sweep_loop(self) -> None:
+        # expires flows on quiet links where no packet arrives to trigger a sweep
+        while not self._stop.wait(self.sweep_interval):
+            self.sweep(time.time())
+            self.save_due()
+
+    def save_due(self) -> None:
+        """Save the baseline and write a checkpoint when their intervals have passed."""
+        now = time.monotonic()
+        if self.baseline_file and now >= self._next_baseline_save:
+            self.baseline.save(self.baseline_file)
+            self._next_baseline_save = now + self.baseline_save_interval
+        if self.checkpoint_file and now >= self._next_checkpoint:
+            self.checkpoint(self.checkpoint_file)
+            self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+
+    def checkpoint(self, path: str) -> int:
+        """Write open flows and the baseline to ``path``; return the flow count.
+
+        Flows are serialized in chunks of ``CHECKPOINT_CHUNK``, each under a
+        short hold of the lock, so capture only pauses for one chunk at a time.
+        Flows opened while the checkpoint is written are left for the next one.
+        """
+        start = time.perf_counter()
+        with self.lock:
+            keys = list(self.flows)
+        pause = 0.0
+
+        def encoded():
+            nonlocal pause
+            get = self.flows.get
+            for i in range(0, len(keys), CHECKPOINT_CHUNK):
+                held = time.perf_counter()
+                with self.lock:
+                    chunk = []
+                    for key in keys[i:i + CHECKPOINT_CHUNK]:
+                        state = get(key)
+                        if state is not None:
+                            chunk.append(((key.src, key.src_port, key.dst, key.dst_port), state.pack()))
+                pause = max(pause, time.perf_counter() - held)
+                yield from chunk
+
+        count = write_checkpoint(path, encoded(), self.baseline.dumps(), time.time())
+        self._checkpoint_pause.observe(pause)
+        self._checkpoint_time.observe(time.perf_counter() - start)
+        return count
+
+    def restore(self, path: str) -> int:
+        """Load flows and the baseline written by :meth:`checkpoint`."""
+        _, flows, baseline = read_checkpoint(path)
+        if baseline:
+            self.baseline.loads(baseline)
+        with self.lock:
+            for key, data in flows:
+                self.flows.insert(FlowKey(*key), FlowState.unpack(data))
+            evicted = self.flows.evict_overflow()
+        for item in evicted:
+            self._finalize_flow(*item)
+        return len(flows)
+
+    def sweep(self, now: float) -> int:
+        """Finalize every flow past its idle or active timeout at ``now``."""
+        with self.lock:
+            expired = self.flows.expire(now)
+            self._next_sweep = now + self.sweep_interval
+        for key, state, reason in expired:
+            self._finalize_flow(key, state, reason)
+        return len(expired)
+
+    def replay(self, paths: List[str], batch_size: int = 4096) -> Dict:
+        """Feed pcap files through the flow table and return throughput stats."""
+        packets = 0
+        started = time.perf_counter()
+        for batch in iter_batches(paths, batch_size):
+            packets += len(batch)
+            selected = self.policy.select(batch)
+            self._filtered.inc(len(batch) - len(selected))
+            self.process_batch(selected)
+        flows = self.flush()
+        elapsed = time.perf_counter() - started
+        return {
+            "files": len(paths),
+            "packets": packets,
+            "flows_flushed": flows,
+            "seconds": elapsed,
+            "packets_per_sec": packets / elapsed if elapsed else 0.0,
+        }
+
+    def process_batch(self, records: List[PacketRecord]) -> None:
+        self._packets.inc(len(records))
+        process = self._process_record
+        for rec in records:
+            process(rec)
+
+    def flush(self) -> int:
+        """Finalize every open flow, e.g. at the end of a replay."""
+        with self.lock:
+            drained = [(key, self.flows.pop(key)) for key in list(self.flows)]
+        for key, state in drained:
+            self._finalize_flow(key, state, "flush")
+        return len(drained)
 
     def _process_packet(self, pkt):
-        if not (IP in pkt and TCP in pkt):
+        rec = record_from_scapy(pkt)
+        if rec is None:
             return
-        ip = pkt[IP]
-        tcp = pkt[TCP]
-        key = FlowKey(ip.src, tcp.sport, ip.dst, tcp.dport)
-        state = self.flows.setdefault(key, FlowState([], start_time=time.time()))
-        state.packets.append(pkt)
-        state.bytes += len(pkt)
-        state.last_seen = time.time()
-        if Raw in pkt:
-            state.payload += bytes(pkt[Raw].load)
-        if tcp.flags.F or tcp.flags.R:
-            self._finalize_flow(key)
-
-    def _finalize_flow(self, key: FlowKey) -> None:
-        state = self.flows.pop(key, None)
-        if not state:
+        if not self.policy.matches(rec):
+            self._filtered.inc()
             return
+        self._packets.inc()
+        self._process_record(rec)
+
+    def _process_record(self, rec: PacketRecord) -> None:
+        flows = self.flows
+        finished: List[Expired] = []
+        with self.lock:
+            found = flows.touch(rec)
+            if found is not None:
+                key, state, forward = found
+                if self.payload_budget and state.payload_bytes >= self.payload_budget:
+                    state.count(rec, forward)
+                else:
+                    state.add(rec, forward, self.max_samples)
+                    # SYNs carry no payload but anchor the stream's sequence numbers
+                    if (rec.payload_len or rec.flags & SYN) and (forward or self.reassembly.inspectors):
+                        self._reassemble(state, rec, forward)
+                # a connection ends on RST or once both sides have sent FIN
+                if rec.flags & RST or state.fin_mask == 3:
+                    flows.pop(key)
+                    finished.append((key, state, "rst" if rec.flags & RST else "fin"))
+                elif len(flows) > flows.max_flows:
+                    finished.extend(flows.evict_overflow())
+            else:
+                self._untracked.inc()
+            if rec.ts >= self._next_sweep:
+                self._next_sweep = rec.ts + self.sweep_interval
+                finished.extend(flows.expire(rec.ts))
+        for item in finished:
+            self._finalize_flow(*item)
+
+    def _reassemble(self, state: FlowState, rec: PacketRecord, forward: bool) -> None:
+        streams = state.streams
+        if streams is None:
+            capacity = self.payload_capacity
+            streams = state.streams = self.reassembly.open(lambda data: state.append_payload(data, capacity))
+        self.reassembly.add(streams, rec, forward)
+
+    def _finalize_flow(self, key: FlowKey, state: FlowState, reason: str) -> None:
+        start = time.perf_counter()
+        inspection = None
+        if state.streams is not None:
+            with self.lock:
+                inspection = self.reassembly.close(state.streams)
+            state.streams = None
         features = self._extract_features(state)
-        ml_result = self.ml.analyze(features)
-        deviation = self.baseline.score(features.values())
-        self.baseline.update(features.values())
-        threats = self.threatintel.check(state)
+        self._feature_time.observe(time.perf_counter() - start)
+        deviation = self.baseline.observe(features.values())
+        threats = self.threatintel.check(key.src, key.dst, state.payload_sample)
         report = {
             "flow": key.__dict__,
+            "end_reason": reason,
             "features": features,
-            "ml_result": ml_result,
             "baseline_deviation": deviation,
             "threat_matches": threats,
         }
-        print(json.dumps(report))
+        if inspection is not None and state.payload_bytes:
+            report["inspection"] = inspection
+        self._finalize_time.observe(time.perf_counter() - start)
+        self._finalized[reason].inc()
+        signature_hits = inspection.get("signatures") if inspection else None
+        reason = self.triage.skip_reason(report, signature_hits, self.baseline.count)
+        if reason is None:
+            self.scoring.submit(report)
+        else:
+            self._skipped[reason].inc()
+            self.scoring.skip(report, reason)
+
+    def close(self) -> None:
+        """Stop background threads once every queued flow has been scored."""
+        self._stop.set()
+        self.threatintel.stop()
+        self.scoring.close()
+        if self.sink is not None:
+            self.sink.close()
+        if self.baseline_file:
+            self.baseline.save(self.baseline_file)
+        if self.checkpoint_file:
+            self.checkpoint(self.checkpoint_file)
 
     @staticmethod
     def _extract_features(state: FlowState) -> Dict:
+        """CICFlowMeter-style feature vector of a finalized flow.
+
+        Counters are exact; size and inter-arrival statistics come from the
+        packets sampled in the flow's arrays.
+        """
         duration = state.last_seen - state.start_time
-        return {
-            "packet_count": len(state.packets),
+        bwd_packets = state.packet_count - state.fwd_packets
+        bwd_bytes = state.bytes - state.fwd_bytes
+        features = {
+            "packet_count": state.packet_count,
             "total_bytes": state.bytes,
             "duration": duration,
-            "payload_size": len(state.payload),
+            "payload_size": state.payload_bytes,
+            "fwd_packets": state.fwd_packets,
+            "bwd_packets": bwd_packets,
+            "fwd_bytes": state.fwd_bytes,
+            "bwd_bytes": bwd_bytes,
+            "fwd_payload_bytes": state.fwd_payload_bytes,
+            "bwd_payload_bytes": state.payload_bytes - state.fwd_payload_bytes,
+            "down_up_ratio": bwd_packets / state.fwd_packets if state.fwd_packets else 0.0,
+            "packets_per_sec": state.packet_count / duration if duration > 0 else 0.0,
+            "bytes_per_sec": state.bytes / duration if duration > 0 else 0.0,
+        }
+        for name, count in zip(FLAG_NAMES, state.flag_counts):
+            features[f"{name}_count"] = count
+
+        sizes = np.frombuffer(state.sizes, dtype=np.uint32).astype(float)
+        times = np.frombuffer(state.timestamps, dtype=float)
+        fwd = np.frombuffer(state.directions, dtype=np.int8).astype(bool)
+        iat = np.diff(times)
+        if sizes.size:
+            pcts = np.percentile(sizes, SIZE_PERCENTILES)
+            features.update(
+                size_min=sizes.min(),
+                size_max=sizes.max(),
+                size_mean=sizes.mean(),
+                size_std=sizes.std(),
+                **{f"size_p{p}": v for p, v in zip(SIZE_PERCENTILES, pcts)},
+            )
+        else:
+            features.update(size_min=0.0, size_max=0.0, size_mean=0.0, size_std=0.0)
+            features.update({f"size_p{p}": 0.0 for p in SIZE_PERCENTILES})
+        for prefix, mask in (("fwd", fwd), ("bwd", ~fwd)):
+            part = sizes[mask]
+            features[f"{prefix}_size_mean"] = part.mean() if part.size else 0.0
+            features[f"{prefix}_size_max"] = part.max() if part.size else 0.0
+            part_iat = np.diff(times[mask])
+            features[f"{prefix}_iat_mean"] = part_iat.mean() if part_iat.size else 0.0
+        if iat.size:
+            features.update(
+                iat_min=iat.min(), iat_max=iat.max(), iat_mean=iat.mean(), iat_std=iat.std()
+            )
+        else:
+            features.update(iat_min=0.0, iat_max=0.0, iat_mean=0.0, iat_std=0.0)
+        return {
+            name: float(value) if isinstance(value, np.generic) else value
+            for name, value in features.items()
         }
 
 
@@ -149,9 +1128,325 @@ def main() -> None:
         default="http://localhost:11434/api/generate",
         help="Ollama inference API URL",
     )
+    parser.add_argument(
+        "--pcap", nargs="+", metavar="FILE", help="Replay pcap/pcapng files instead of sniffing"
+    )
+    parser.add_argument("--pcap-dir", help="Replay every capture file below this directory")
+    parser.add_argument(
+        "--batch-size", type=int, default=4096, help="Packets per replay batch"
+    )
+    parser.add_argument(
+        "--payload-sample",
+        type=int,
+        default=PAYLOAD_SAMPLE_BYTES,
+        help="Payload bytes kept per flow for inspection",
+    )
+    parser.add_argument(
+        "--packet-samples",
+        type=int,
+        default=MAX_PACKET_SAMPLES,
+        help="Per-packet timestamps/sizes kept per flow",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=IDLE_TIMEOUT,
+        help="Seconds without packets before a flow is finalized",
+    )
+    parser.add_argument(
+        "--active-timeout",
+        type=float,
+        default=ACTIVE_TIMEOUT,
+        help="Maximum flow lifetime in seconds before it is finalized",
+    )
+    parser.add_argument(
+        "--max-flows",
+        type=int,
+        default=MAX_FLOWS,
+        help="Hard cap on tracked flows; least recently seen flows are evicted",
+    )
+    parser.add_argument(
+        "--sweep-interval",
+        type=float,
+        default=SWEEP_INTERVAL,
+        help="Seconds between flow expiry sweeps",
+    )
+    parser.add_argument("--ml-workers", type=int, default=ML_WORKERS, help="Model scoring threads")
+    parser.add_argument(
+        "--ml-batch-size", type=int, default=ML_BATCH_SIZE, help="Flows scored per model request"
+    )
+    parser.add_argument(
+        "--ml-queue-size", type=int, default=ML_QUEUE_SIZE, help="Finalized flows waiting for scoring"
+    )
+    parser.add_argument(
+        "--ml-policy",
+        choices=QUEUE_POLICIES,
+        default="drop",
+        help="What to do when the scoring queue is full",
+    )
+    parser.add_argument(
+        "--ml-sample-every",
+        type=int,
+        default=ML_SAMPLE_EVERY,
+        help="With --ml-policy sample, score 1 in N flows once the queue is half full",
+    )
+    parser.add_argument(
+        "--baseline-metric",
+        choices=BASELINE_METRICS,
+        default="zscore",
+        help="Distance used for baseline deviation",
+    )
+    parser.add_argument(
+        "--baseline-half-life",
+        type=float,
+        help="Flows after which an observation's weight in the baseline halves",
+    )
+    parser.add_argument(
+        "--baseline-refresh",
+        type=int,
+        default=BASELINE_REFRESH,
+        help="Flows between recomputing the inverse covariance for mahalanobis",
+    )
+    parser.add_argument("--baseline-file", help="Load the baseline from and save it to this file")
+    parser.add_argument(
+        "--baseline-save-interval",
+        type=float,
+        default=BASELINE_SAVE_INTERVAL,
+        help="Seconds between baseline saves during live capture",
+    )
+    parser.add_argument(
+        "--signatures",
+        nargs="+",
+        metavar="FILE",
+        help="Payload signature files (CSV rows of name,pattern[,label])",
+    )
+    parser.add_argument(
+        "--signature-depth",
+        type=int,
+        default=SCAN_DEPTH,
+        help="Reassembled bytes scanned for signatures per flow direction",
+    )
+    parser.add_argument(
+        "--triage-threshold",
+        type=float,
+        help="Only send flows with at least this baseline deviation or a threat-intel hit to the model",
+    )
+    parser.add_argument(
+        "--triage-warmup",
+        type=int,
+        default=TRIAGE_WARMUP,
+        help="Flows the baseline must have seen before --triage-threshold applies",
+    )
+    parser.add_argument(
+        "--model-rate",
+        type=float,
+        default=0.0,
+        help="Flows per second sent to the model, split across workers (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--verdict-cache",
+        type=int,
+        default=0,
+        metavar="N",
+        help=f"Reuse verdicts of up to N recently scored feature buckets (0 disables, e.g. {CACHE_SIZE})",
+    )
+    parser.add_argument(
+        "--verdict-cache-ttl",
+        type=float,
+        default=CACHE_TTL,
+        help="Seconds a cached verdict stays valid",
+    )
+    parser.add_argument(
+        "--reassembly-depth",
+        type=int,
+        default=REASSEMBLY_DEPTH,
+        help="In-order payload bytes reassembled per flow direction",
+    )
+    parser.add_argument(
+        "--reassembly-buffer",
+        type=int,
+        default=FLOW_BUFFER,
+        help="Out-of-order bytes buffered per flow direction",
+    )
+    parser.add_argument(
+        "--reassembly-memory-mb",
+        type=float,
+        default=MAX_BUFFERED / 2**20,
+        help="Out-of-order bytes buffered across all flows, in MiB",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        help="Restore open flows and the baseline from this file on startup and checkpoint them to it",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=CHECKPOINT_INTERVAL,
+        help="Seconds between checkpoints during live capture",
+    )
+    parser.add_argument(
+        "--intel",
+        nargs="+",
+        metavar="FILE",
+        help="Indicator files: STIX 2.x bundles (.json) or CSV/plain lists",
+    )
+    parser.add_argument(
+        "--intel-reload",
+        type=float,
+        default=INTEL_RELOAD_INTERVAL,
+        help="Seconds between checks for changed indicator files (0 disables)",
+    )
+    parser.add_argument(
+        "--output",
+        action="append",
+        metavar="SPEC",
+        help="Report destination, repeatable: '-' (stdout, default), jsonl:DIR, jsonl.gz:DIR or parquet:DIR",
+    )
+    parser.add_argument(
+        "--rotate-mb",
+        type=float,
+        default=ROTATE_BYTES / 2**20,
+        help="Start a new output file after this many MiB",
+    )
+    parser.add_argument(
+        "--rotate-seconds",
+        type=float,
+        default=ROTATE_SECONDS,
+        help="Start a new output file after this many seconds",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Flow-processing processes; packets are sharded by connection",
+    )
+    parser.add_argument("--bpf", help="Capture filter expression replacing the generated one (live only)")
+    parser.add_argument(
+        "--ports",
+        nargs="+",
+        default=[],
+        metavar="PORT",
+        help="Only capture these ports or ranges, e.g. 443 8000-8100",
+    )
+    parser.add_argument(
+        "--control-elsewhere",
+        action="store_true",
+        help="With --ports, still capture SYN/FIN/RST packets on every other port",
+    )
+    parser.add_argument(
+        "--snaplen",
+        type=int,
+        default=0,
+        help=f"Bytes of each packet copied from the kernel (0 = all, {HEADER_SNAPLEN} = headers only)",
+    )
+    parser.add_argument(
+        "--payload-budget",
+        type=int,
+        default=0,
+        help="Payload bytes per flow after which packets are only counted (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--sample-flows", type=int, default=1, metavar="N", help="Keep 1 in N connections"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="Serve Prometheus metrics on this port (0 disables); worker N uses port + N",
+    )
+    parser.add_argument("--metrics-addr", default="127.0.0.1", help="Address for the metrics endpoint")
     args = parser.parse_args()
-    engine = TrafficEngine(args.iface, args.ollama_url)
-    engine.start()
+    policy = CapturePolicy(
+        bpf=args.bpf,
+        ports=args.ports,
+        control_elsewhere=args.control_elsewhere,
+        snaplen=args.snaplen,
+        payload_budget=args.payload_budget,
+        sample_rate=args.sample_flows,
+    )
+    engine_kwargs = dict(
+        payload_capacity=args.payload_sample,
+        max_samples=args.packet_samples,
+        idle_timeout=args.idle_timeout,
+        active_timeout=args.active_timeout,
+        max_flows=args.max_flows,
+        sweep_interval=args.sweep_interval,
+        ml_workers=args.ml_workers,
+        ml_batch_size=args.ml_batch_size,
+        ml_queue_size=args.ml_queue_size,
+        ml_policy=args.ml_policy,
+        ml_sample_every=args.ml_sample_every,
+        baseline_metric=args.baseline_metric,
+        baseline_half_life=args.baseline_half_life,
+        baseline_refresh=args.baseline_refresh,
+        baseline_file=args.baseline_file,
+        baseline_save_interval=args.baseline_save_interval,
+        intel_paths=args.intel,
+        intel_reload_interval=args.intel_reload,
+        signature_paths=args.signatures,
+        signature_depth=args.signature_depth,
+        triage_threshold=args.triage_threshold,
+        triage_warmup=args.triage_warmup,
+        model_rate=args.model_rate,
+        verdict_cache_size=args.verdict_cache,
+        verdict_cache_ttl=args.verdict_cache_ttl,
+        reassembly_depth=args.reassembly_depth,
+        reassembly_buffer=args.reassembly_buffer,
+        reassembly_memory=int(args.reassembly_memory_mb * 2**20),
+        checkpoint_file=args.checkpoint,
+        checkpoint_interval=args.checkpoint_interval,
+        policy=policy,
+    )
+    paths = collect_paths(args.pcap, args.pcap_dir) if args.pcap or args.pcap_dir else None
+    sink_factory = functools.partial(
+        build_sink, args.output, int(args.rotate_mb * 2**20), args.rotate_seconds
+    )
+
+    if args.workers > 1:
+        def make_engine(shard: int, emit: Callable[[Dict], None]) -> TrafficEngine:
+            kwargs = dict(engine_kwargs, emit=emit)
+            if args.baseline_file:
+                kwargs["baseline_file"] = f"{args.baseline_file}.{shard}"
+            if args.checkpoint:
+                kwargs["checkpoint_file"] = f"{args.checkpoint}.{shard}"
+            kwargs["model_rate"] = args.model_rate / args.workers
+            engine = TrafficEngine(args.iface, args.ollama_url, **kwargs)
+            if args.metrics_port:
+                engine.metrics.serve(args.metrics_port + shard, args.metrics_addr)
+            return engine
+
+        runner = ShardedRunner(
+            make_engine,
+            args.workers,
+            sink_factory,
+            live=paths is None,
+            sweep_interval=args.sweep_interval,
+        )
+        if args.metrics_port:
+            # workers use port + shard; the capturing process comes after them
+            runner.metrics.serve(args.metrics_port + args.workers, args.metrics_addr)
+        if paths is not None:
+            print(json.dumps({"replay": runner.replay(paths, args.batch_size, policy)}), file=sys.stderr)
+        else:
+            runner.capture(args.iface, policy, record_from_scapy)
+        return
+
+    sink = sink_factory()
+    engine = TrafficEngine(args.iface, args.ollama_url, emit=sink.write, **engine_kwargs)
+    if args.metrics_port:
+        engine.metrics.serve(args.metrics_port, args.metrics_addr)
+    try:
+        if paths is not None:
+            stats = engine.replay(paths, args.batch_size)
+            print(json.dumps({"replay": stats}), file=sys.stderr)
+        else:
+            engine.start()
+    finally:
+        engine.close()
+        sink.close()
+        engine.metrics.close()
+        print(json.dumps({"scoring": engine.scoring.stats}), file=sys.stderr)
 
 
 if __name__ == "__main__":
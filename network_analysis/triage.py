@@ -0,0 +1,125 @@
+"""Deciding which finalized flows are worth a model request.
+
+``Triage`` lets a flow through to the model only when something marks it as
+unusual: a threat-intel hit or a baseline deviation above the threshold.
+Signature hits are already a verdict, so those flows never reach the model.
+Flows that pass are then limited by a ``TokenBucket`` of model requests per
+second. ``VerdictCache`` answers flows whose features look like a recently
+scored flow without asking the model again.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from signatures import only_benign
+
+TRIAGE_WARMUP = 1000
+CACHE_SIZE = 10_000
+CACHE_TTL = 600.0
+# buckets per unit of log(1 + |value|): neighbouring buckets differ by ~28%
+CACHE_STEPS = 4
+SKIP_REASONS = ("signature_match", "benign_signature", "below_threshold")
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second on average, with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst else max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+class VerdictCache:
+    """Recent model verdicts keyed by log-bucketed flow features.
+
+    Each feature is mapped to ``round(sign(v) * log(1 + |v|) * steps)``, so
+    flows whose features differ by a few percent share a key. Entries expire
+    after ``ttl`` seconds and the least recently used are evicted beyond
+    ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL, steps: int = CACHE_STEPS) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.steps = steps
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, Tuple[float, Dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, features: Dict) -> bytes:
+        x = np.fromiter(features.values(), dtype=float)
+        return np.rint(np.sign(x) * np.log1p(np.abs(x)) * self.steps).astype(np.int32).tobytes()
+
+    def get(self, features: Dict) -> Optional[Dict]:
+        key = self.key(features)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, features: Dict, verdict: Dict) -> None:
+        if "error" in verdict:
+            return
+        key = self.key(features)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Triage:
+    """Gates finalized flows on signature hits, threat intel and baseline deviation.
+
+    Without a ``threshold`` every flow without a signature hit goes to the
+    model. With one, a flow needs a threat-intel hit or a deviation of at
+    least ``threshold``. Until the baseline has seen ``warmup`` flows its
+    deviations mean little, so every flow passes.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, warmup: int = TRIAGE_WARMUP) -> None:
+        self.threshold = threshold
+        self.warmup = warmup
+
+    def skip_reason(
+        self, report: Dict, signature_hits: Optional[List[Dict[str, str]]], baseline_count: int
+    ) -> Optional[str]:
+        """Why ``report`` should not be scored by the model, or ``None`` to score it."""
+        if signature_hits:
+            # the signature verdict stands; the model would only repeat it
+            return "benign_signature" if only_benign(signature_hits) else "signature_match"
+        if self.threshold is None or report["threat_matches"] or baseline_count < self.warmup:
+            return None
+        if report["baseline_deviation"] >= self.threshold:
+            return None
+        return "below_threshold"